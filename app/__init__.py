@@ -1,29 +1,98 @@
-from flask import Flask
-from flask_migrate import Migrate
+"""The blog, built by ``create_app``.
+
+Extensions live at module level and are bound to an app by ``create_app``,
+so that importing ``app`` (models, CLI commands, background jobs) does not
+build one. Flask-Admin with CKEditor and the JSON API are imported only when
+ADMIN_ENABLED / API_ENABLED are on; Pillow and Alembic are imported on first
+use (an upload, a ``manage.py db`` command). ``benchmarks/startup.py``
+reports what the import and the factory cost. With TEMPLATES_PRELOAD the
+factory also loads every template from the compiled-template cache.
+
+The extensions keep the state of the app they are bound to (settings,
+worker pools, caches, the metrics registry), so a process serves one app.
+Every ``create_app`` binds them to the new app, and an app built before it
+refuses requests instead of running on the newer app's state; tests build
+a fresh app for every test.
+"""
+from flask import Flask, current_app
 
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
+from app.database import Database
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
-from flask_admin import Admin
-from flask_ckeditor import CKEditor
-
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-login = LoginManager(app)
-migrate = Migrate(app, db)
-login.login_view = 'login'
-login.login_message_category = 'info'
 
-ckeditor = CKEditor(app)
+db = Database()
+bcrypt = Bcrypt()
+login = LoginManager()
+login.login_view = 'main.login'
+login.login_message_category = 'info'
 
-from app import modelviews
 from app import models
-from flask_admin.contrib.sqla import ModelView
+from app.last_seen import LastSeenBuffer
+from app.images import AvatarPipeline
+from app.fragment_cache import FragmentCache
+from app.passwords import hasher
+from app.query_stats import QueryStats
+from app.metrics import Metrics
+from app.profiling import RequestProfiler
+from app.compression import Compressor
+from app.static_files import StaticFiles
+from app.ratelimit import RateLimiter
+from app.templating import TemplateCache
+
+last_seen = LastSeenBuffer()
+avatars = AvatarPipeline()
+fragment_cache = FragmentCache()
+query_stats = QueryStats()
+metrics = Metrics()
+profiler = RequestProfiler()
+compressor = Compressor()
+static_files = StaticFiles()
+limiter = RateLimiter()
+templates = TemplateCache()
+
+# The app the extensions are bound to.
+_bound_app = None
+
+
+def _check_bound():
+    if current_app._get_current_object() is not _bound_app:
+        raise RuntimeError('The extensions were bound to an app created later; '
+                           'there can be one app per process.')
+
+
+def create_app(config=Config):
+    global _bound_app
+    app = Flask(__name__)
+    app.config.from_object(config)
+    _bound_app = app
+    app.before_request(_check_bound)
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login.init_app(app)
+
+    last_seen.init_app(app)
+    models.user_cache.init_app(app)
+    avatars.init_app(app)
+    fragment_cache.init_app(app)
+    hasher.init_app(app)
+    query_stats.init_app(app)
+    metrics.init_app(app, pools=(avatars.pool, hasher.pool))
+    profiler.init_app(app)
+    # after_request hooks run last-registered first: precompressed files win.
+    compressor.init_app(app)
+    static_files.init_app(app)
+    limiter.init_app(app)
+    templates.init_app(app)
 
-admin = Admin(app, index_view=modelviews.MyAdminIndexView())
-admin.add_view(modelviews.UserAdminView(models.User, db.session))
-admin.add_view(modelviews.PostAdminView(models.Post, db.session))
-from app import views
\ No newline at end of file
+    if app.config['ADMIN_ENABLED']:
+        from app.modelviews import init_admin
+        init_admin(app)
+    from app.views import bp as main_blueprint
+    app.register_blueprint(main_blueprint)
+    if app.config['API_ENABLED']:
+        from app.api import blueprint as api_blueprint
+        app.register_blueprint(api_blueprint)
+    if app.config['TEMPLATES_PRELOAD']:
+        templates.preload(app)
+    return app
@@ -0,0 +1,197 @@
+"""JSON API for posts and users at /api/v1 (Swagger UI at /api/v1/docs).
+
+Lists are paged by keyset cursors: follow ``next``/``prev`` of the
+response with ``?after=`` or ``?before=``. ``?fields=id,title`` returns only
+those fields and only loads their columns; the author of a post is joined
+in the same query when ``author`` is requested. ``/posts/batch?ids=1,2,3``
+fetches up to MAX_LIMIT rows in one request.
+
+The API uses the login session of the site and only reads, so it is served
+from the read replica when one is configured.
+"""
+from functools import wraps
+
+from flask import Blueprint, request
+from flask_login import current_user
+from flask_restplus import Api, Resource, fields, marshal
+from sqlalchemy.orm import joinedload, load_only
+
+from .database import read_replica
+from .models import User, Post
+from .pagination import keyset_paginate
+from .search import search_posts, prefix_range
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def login_required(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            api.abort(401, 'Log in to use the API')
+        return func(*args, **kwargs)
+    return wrapper
+
+
+blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+api = Api(blueprint, version='1.0', title='PadalkaIvLabs API', doc='/docs',
+          decorators=[login_required, read_replica])
+posts_ns = api.namespace('posts', description='Blog posts')
+users_ns = api.namespace('users', description='Public user profiles')
+
+author_model = api.model('Author', {
+    'id': fields.Integer,
+    'username': fields.String,
+})
+post_model = api.model('Post', {
+    'id': fields.Integer,
+    'title': fields.String,
+    'body': fields.String,
+    'body_format': fields.String,
+    'body_html': fields.String,
+    'excerpt': fields.String,
+    'timestamp': fields.DateTime,
+    'update_time': fields.DateTime,
+    'version': fields.Integer,
+    'user_id': fields.Integer,
+    'author': fields.Nested(author_model, allow_null=True),
+})
+user_model = api.model('User', {
+    'id': fields.Integer,
+    'username': fields.String,
+    'about_me': fields.String,
+    'image_file': fields.String,
+    'last_seen': fields.DateTime,
+    'post_count': fields.Integer,
+})
+
+list_parser = api.parser()
+list_parser.add_argument('after', help='Cursor of the page after')
+list_parser.add_argument('before', help='Cursor of the page before')
+list_parser.add_argument('limit', type=int, default=DEFAULT_LIMIT, help=f'At most {MAX_LIMIT}')
+list_parser.add_argument('fields', help='Comma-separated fields to return')
+list_parser.add_argument('q', help='Search text (posts) or username prefix (users)')
+batch_parser = api.parser()
+batch_parser.add_argument('ids', required=True, help='Comma-separated ids')
+batch_parser.add_argument('fields', help='Comma-separated fields to return')
+
+
+def requested_fields(model):
+    names = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+    unknown = sorted(set(names) - set(model))
+    if unknown:
+        api.abort(400, f"Unknown fields: {', '.join(unknown)}")
+    return names or list(model)
+
+
+def limit_arg():
+    return min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+
+
+def ids_arg():
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        api.abort(400, 'ids must be comma-separated integers')
+    if not ids or len(ids) > MAX_LIMIT:
+        api.abort(400, f'Pass between 1 and {MAX_LIMIT} ids')
+    return ids
+
+
+def load_fields(model, query, names, always=('id',)):
+    """Only load the columns behind ``names``, plus the ``always`` ones."""
+    columns = {name for name in names if name in model.__table__.columns} | set(always)
+    return query.options(load_only(*columns))
+
+
+def post_query(names):
+    query = load_fields(Post, Post.query, names, always=('id', 'timestamp'))
+    if 'author' in names:
+        query = query.options(joinedload(Post.author).load_only('id', 'username'))
+    return query
+
+
+def dump(items, model, names):
+    return marshal(items, model, mask='{' + ','.join(names) + '}')
+
+
+def by_ids(model, query, ids, names, schema):
+    found = {item.id: item for item in query.filter(model.id.in_(ids))}
+    return {'items': dump([found[i] for i in ids if i in found], schema, names),
+            'missing': [i for i in ids if i not in found]}
+
+
+@posts_ns.route('')
+class PostList(Resource):
+    @api.expect(list_parser)
+    def get(self):
+        """Newest posts first, or the best matches of ``q``."""
+        names = requested_fields(post_model)
+        query = post_query(names)
+        q = request.args.get('q')
+        if q:
+            # Ranked results cannot be keyset paged; 'page' numbers them instead.
+            page = max(request.args.get('page', 1, type=int), 1)
+            limit = limit_arg()
+            items = search_posts(q, query).limit(limit + 1).offset((page - 1) * limit).all()
+            return {'items': dump(items[:limit], post_model, names),
+                    'next_page': page + 1 if len(items) > limit else None}
+        page = keyset_paginate(query, (Post.timestamp, Post.id), limit_arg(),
+                               after=request.args.get('after'), before=request.args.get('before'))
+        return {'items': dump(page.items, post_model, names),
+                'next': page.next_cursor, 'prev': page.prev_cursor}
+
+
+@posts_ns.route('/batch')
+class PostBatch(Resource):
+    @api.expect(batch_parser)
+    def get(self):
+        """Posts by id, in the order asked for."""
+        names = requested_fields(post_model)
+        return by_ids(Post, post_query(names), ids_arg(), names, post_model)
+
+
+@posts_ns.route('/<int:id>')
+class PostItem(Resource):
+    def get(self, id):
+        names = requested_fields(post_model)
+        post = post_query(names).filter(Post.id == id).first()
+        if post is None:
+            api.abort(404, 'No such post')
+        return dump(post, post_model, names)
+
+
+@users_ns.route('')
+class UserList(Resource):
+    @api.expect(list_parser)
+    def get(self):
+        """Users by id, optionally those whose username starts with ``q``."""
+        names = requested_fields(user_model)
+        query = load_fields(User, User.query, names)
+        q = request.args.get('q', '').strip()
+        if q:
+            query = query.filter(prefix_range(User.username, q))
+        page = keyset_paginate(query, (User.id,), limit_arg(), after=request.args.get('after'),
+                               before=request.args.get('before'), descending=False)
+        return {'items': dump(page.items, user_model, names),
+                'next': page.next_cursor, 'prev': page.prev_cursor}
+
+
+@users_ns.route('/batch')
+class UserBatch(Resource):
+    @api.expect(batch_parser)
+    def get(self):
+        """Users by id, in the order asked for."""
+        names = requested_fields(user_model)
+        return by_ids(User, load_fields(User, User.query, names), ids_arg(), names, user_model)
+
+
+@users_ns.route('/<int:id>')
+class UserItem(Resource):
+    def get(self, id):
+        names = requested_fields(user_model)
+        user = load_fields(User, User.query, names).filter(User.id == id).first()
+        if user is None:
+            api.abort(404, 'No such user')
+        return dump(user, user_model, names)
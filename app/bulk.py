@@ -0,0 +1,110 @@
+"""Set-based bulk changes to users and posts for the admin pages.
+
+Each operation runs one UPDATE or DELETE per chunk of BULK_CHUNK_SIZE ids
+and commits every chunk, so thousands of rows take a handful of statements
+and no transaction holds its locks for long. Rows are never loaded into
+the session; caches are invalidated and User.post_count is updated
+explicitly, since the session and mapper events do not see bulk statements.
+"""
+from flask import current_app
+from sqlalchemy import func, or_
+
+from app import db
+from app.models import User, Post, user_cache
+
+
+def _chunks(ids, keep=None):
+    ids = sorted({int(i) for i in ids} - {keep})
+    size = current_app.config['BULK_CHUNK_SIZE']
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _invalidate(user_ids=(), posts=False):
+    from app import fragment_cache
+
+    if user_ids:
+        user_cache.invalidate(*user_ids)
+    tags = [f'user:{user_id}' for user_id in user_ids]
+    if posts:
+        tags.append('posts')
+    fragment_cache.invalidate(*tags)
+
+
+def _authors(post_ids):
+    return [user_id for user_id, in db.session.query(Post.user_id)
+            .filter(Post.id.in_(post_ids), Post.user_id.isnot(None)).distinct()]
+
+
+def recount_posts(user_ids=None):
+    """Recompute User.post_count of ``user_ids``, or of every user.
+
+    One correlated UPDATE, counted on the (user_id, timestamp) index of post.
+    Does not commit.
+    """
+    count = db.session.query(func.count(Post.id)).filter(Post.user_id == User.id).as_scalar()
+    query = User.query
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    query.update({User.post_count: count}, synchronize_session=False)
+
+
+def delete_users(ids, keep=None):
+    """Delete users and all of their posts, except user ``keep``.
+
+    Returns the numbers of users and posts deleted.
+    """
+    users = posts = 0
+    for chunk in _chunks(ids, keep):
+        posts += Post.query.filter(Post.user_id.in_(chunk)).delete(synchronize_session=False)
+        users += User.query.filter(User.id.in_(chunk)).delete(synchronize_session=False)
+        db.session.commit()
+        _invalidate(chunk, posts=True)
+    return users, posts
+
+
+def set_admin(ids, admin, keep=None):
+    """Grant or revoke the admin permission of everyone but user ``keep``.
+
+    Returns the number of users changed.
+    """
+    changed = 0
+    for chunk in _chunks(ids, keep):
+        changed += User.query.filter(User.id.in_(chunk),
+                                     or_(User.admin.is_(None), User.admin != admin)) \
+            .update({User.admin: admin}, synchronize_session=False)
+        db.session.commit()
+        _invalidate(chunk)
+    return changed
+
+
+def delete_posts_by(user_ids):
+    """Delete every post of the given authors. Returns the number of posts deleted."""
+    deleted = 0
+    for chunk in _chunks(user_ids):
+        deleted += Post.query.filter(Post.user_id.in_(chunk)).delete(synchronize_session=False)
+        User.query.filter(User.id.in_(chunk)).update({User.post_count: 0}, synchronize_session=False)
+        db.session.commit()
+        _invalidate(chunk, posts=True)
+    return deleted
+
+
+def delete_posts(ids):
+    """Delete posts by id. Returns the number of posts deleted."""
+    deleted = 0
+    for chunk in _chunks(ids):
+        authors = _authors(chunk)
+        deleted += Post.query.filter(Post.id.in_(chunk)).delete(synchronize_session=False)
+        if authors:
+            recount_posts(authors)
+        db.session.commit()
+        _invalidate(authors, posts=True)
+    return deleted
+
+
+def authors_of(post_ids):
+    """Ids of the users who wrote the given posts."""
+    authors = set()
+    for chunk in _chunks(post_ids):
+        authors.update(_authors(chunk))
+    return authors
@@ -0,0 +1,113 @@
+"""Response compression negotiated through ``Accept-Encoding``.
+
+Brotli is used when the client accepts it and the ``brotli`` package is
+installed, gzip otherwise. Only text-like responses of at least
+COMPRESS_MIN_SIZE bytes are compressed; smaller ones would barely shrink.
+Streamed responses are compressed chunk by chunk and flushed after every
+chunk, so the client still receives them progressively.
+"""
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip is always available.
+    brotli = None
+
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                'application/x-ndjson', 'image/svg+xml', 'image/x-icon')
+# Files served from disk are compressed too (up to this size), unless a
+# precompressed copy from build_static is served instead.
+MAX_FILE_SIZE = 4 * 1024 * 1024
+
+
+def accepted_encodings(header):
+    """Encodings in an ``Accept-Encoding`` header that are not refused with q=0."""
+    accepted = set()
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        try:
+            if params.startswith('q=') and float(params[2:]) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header or '')
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+        process, finish = compressor.compress, compressor.flush
+
+        def flush():
+            return compressor.flush(zlib.Z_SYNC_FLUSH)
+    for chunk in chunks:
+        data = process(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+def compressible(response):
+    return response.mimetype.startswith(COMPRESSIBLE)
+
+
+class Compressor(object):
+    def __init__(self, app=None):
+        self.min_size = 500
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        app.after_request(self.compress_response)
+
+    def compress_response(self, response):
+        """Compress ``response`` in place if the client asked for it."""
+        if response.status_code != 200 or 'Content-Encoding' in response.headers \
+                or not compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = compress_stream(response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            length = response.content_length
+            if response.direct_passthrough and (length is None or length > MAX_FILE_SIZE):
+                return response
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # A strong ETag promises identical bytes, which no longer holds.
+            response.set_etag(etag, weak=True)
+        return response
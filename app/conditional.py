@@ -0,0 +1,58 @@
+"""Conditional GET support: validators and 304 responses that skip rendering."""
+import hashlib
+import os
+
+from flask import current_app, request, session
+
+_template_version = None
+
+
+def _templates_version():
+    # Changing a template changes every page, so deploys must change ETags.
+    global _template_version
+    if _template_version is None:
+        digest = hashlib.sha1()
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        for root, dirs, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f'{name}:{stat.st_mtime_ns}:{stat.st_size};'.encode('utf-8'))
+        _template_version = digest.hexdigest()[:8]
+    return _template_version
+
+
+def make_etag(*parts):
+    raw = repr((_templates_version(),) + parts).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+def not_modified(etag, last_modified=None, use_last_modified=True):
+    """A 304 response if the client's copy is current, otherwise None.
+
+    Pass ``use_last_modified=False`` when the page can change without its
+    newest row changing, e.g. a listing after a delete.
+    """
+    if '_flashes' in session:
+        # Pending flash messages are part of the page and must be rendered.
+        return None
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif use_last_modified and last_modified and request.if_modified_since:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    response = current_app.response_class(status=304)
+    return set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Pages differ per user, so only the browser may keep them, and it must
+    # revalidate every time.
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,80 @@
+"""Post bodies, sanitized and rendered once when they are written.
+
+``Post.set_body`` stores the raw body as typed (plain text from the site,
+CKEditor HTML from the admin, told apart by ``body_format``) next to
+``body_html``, the sanitized HTML the post page shows, and ``excerpt``, the
+plain-text start of the post the listings show. Pages never clean or
+escape bodies themselves, and listings do not load the bodies at all.
+
+HTML is cleaned with lxml against an allowlist of tags and attributes:
+scripts, styles, event handlers, forms, frames and ``javascript:`` links
+are dropped and links get ``rel="nofollow"``. After changing the rules,
+re-render the stored posts with ``manage.py database render_posts --all``.
+Rows inserted with plain SQL, and the posts that existed before these
+columns, have no ``body_html`` until ``render_posts`` (without ``--all``)
+renders them; until then the pages show their escaped raw body.
+"""
+import re
+
+from lxml import html as lxml_html
+from lxml.html.clean import Cleaner
+from markupsafe import escape
+
+EXCERPT_LENGTH = 200
+
+ALLOWED_TAGS = frozenset([
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'del', 'em', 'h2', 'h3', 'h4', 'hr', 'i',
+    'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup', 'table', 'tbody',
+    'td', 'th', 'thead', 'tr', 'u', 'ul',
+])
+ALLOWED_ATTRIBUTES = frozenset(['alt', 'colspan', 'height', 'href', 'rowspan', 'src', 'title',
+                                'width'])
+
+_cleaner = Cleaner(
+    scripts=True, javascript=True, comments=True, style=True, inline_style=True,
+    links=True, meta=True, page_structure=True, processing_instructions=True,
+    embedded=True, frames=True, forms=True, annoying_tags=True,
+    allow_tags=ALLOWED_TAGS, remove_unknown_tags=False,
+    safe_attrs_only=True, safe_attrs=ALLOWED_ATTRIBUTES, add_nofollow=True,
+)
+# Elements whose end separates words in the excerpt.
+_breaks = ('br', 'p', 'li', 'h2', 'h3', 'h4', 'blockquote', 'pre', 'td', 'th', 'tr', 'hr')
+_whitespace = re.compile(r'\s+')
+_paragraphs = re.compile(r'\n\s*\n')
+
+
+def sanitize(raw):
+    """``raw`` HTML with everything outside the allowlist removed."""
+    if not raw or not raw.strip():
+        return ''
+    fragment = lxml_html.fragment_fromstring(raw, create_parent='div')
+    fragment = _cleaner.clean_html(fragment)
+    children = ''.join(lxml_html.tostring(child, encoding='unicode') for child in fragment)
+    return str(escape(fragment.text or '')) + children
+
+
+def text_to_html(text):
+    """Plain text as HTML paragraphs, with single line breaks kept."""
+    paragraphs = [p.strip() for p in _paragraphs.split((text or '').replace('\r\n', '\n'))]
+    return ''.join('<p>{}</p>'.format(str(escape(p)).replace('\n', '<br>'))
+                   for p in paragraphs if p)
+
+
+def excerpt(body_html, length=EXCERPT_LENGTH):
+    """The first ``length`` characters of the text of ``body_html``, cut at a word."""
+    if not body_html:
+        return ''
+    fragment = lxml_html.fragment_fromstring(body_html, create_parent='div')
+    for element in fragment.iter(*_breaks):
+        element.tail = ' ' + (element.tail or '')
+    text = _whitespace.sub(' ', fragment.text_content()).strip()
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1]
+    return (cut.rsplit(' ', 1)[0] if ' ' in cut else cut).rstrip(',.;:') + '…'
+
+
+def render_body(raw, body_format='text'):
+    """``(body_html, excerpt)`` of a raw body in ``body_format`` ('text' or 'html')."""
+    body_html = sanitize(raw) if body_format == 'html' else text_to_html(raw)
+    return body_html, excerpt(body_html)
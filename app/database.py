@@ -0,0 +1,88 @@
+"""Engine settings per database and routing of reads to a replica.
+
+SQLite files run in WAL mode, so readers no longer wait for writers, with
+the pragmas in the SQLITE_* settings, and keep SQLITE_POOL_SIZE connections
+(and their page caches) open. Server databases use Flask-SQLAlchemy's pool
+settings plus a pre-ping that replaces connections the server has closed.
+
+With SQLALCHEMY_BINDS['replica'] configured, views decorated with
+``@read_replica`` send their queries to that engine. Replicas lag behind, so
+only use it for pages where a slightly stale answer is fine.
+"""
+import sqlite3
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.pool import Pool, QueuePool
+
+REPLICA = 'replica'
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and g.get('read_replica') \
+                and REPLICA in (self.app.config['SQLALCHEMY_BINDS'] or ()):
+            return self.db.get_engine(self.app, bind=REPLICA)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+    def init_app(self, app):
+        super(Database, self).init_app(app)
+        self._sqlite_pragmas = [
+            ('journal_mode', app.config['SQLITE_JOURNAL_MODE']),
+            ('synchronous', app.config['SQLITE_SYNCHRONOUS']),
+            ('busy_timeout', app.config['SQLITE_BUSY_TIMEOUT']),
+            ('mmap_size', app.config['SQLITE_MMAP_SIZE']),
+            ('cache_size', app.config['SQLITE_CACHE_SIZE']),
+        ]
+        if not event.contains(Pool, 'connect', self._on_connect):
+            event.listen(Pool, 'connect', self._on_connect)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername == 'sqlite' and info.database not in (None, '', ':memory:'):
+            # Flask-SQLAlchemy would open a new connection for every checkout.
+            for option in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+                options.pop(option, None)
+            super(Database, self).apply_driver_hacks(app, info, options)
+            pool_size = app.config['SQLITE_POOL_SIZE']
+            if pool_size:
+                options['poolclass'] = QueuePool
+                options['pool_size'] = pool_size
+                options['max_overflow'] = -1
+                # Pooled connections move between threads, one at a time.
+                options.setdefault('connect_args', {})['check_same_thread'] = False
+            return
+        super(Database, self).apply_driver_hacks(app, info, options)
+        if info.drivername != 'sqlite':
+            options['pool_pre_ping'] = app.config['SQLALCHEMY_POOL_PRE_PING']
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in self._sqlite_pragmas:
+            if value is not None:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def read_replica(view):
+    """Run the queries of ``view`` on the replica, when one is configured."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.read_replica = False
+    return wrapper
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileAllowed, FileField
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField
-from wtforms.validators import InputRequired, Length, Email, EqualTo, DataRequired, ValidationError, Regexp
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField, SelectField
+from wtforms.validators import InputRequired, Length, Email, EqualTo, DataRequired, ValidationError, Regexp, \
+    Optional
 from .models import User
 from flask_login import current_user
 
@@ -53,7 +54,7 @@ class UpdateAccountForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
     picture = FileField('Update Picture', validators=[FileAllowed(['jpg', 'png'])])
     about_me = TextAreaField('About Me', validators=[Length(min=0, max=200)])
-    password = PasswordField('Change Password', validators=[Length(min=6, message='This field length must be more 5 characters')])
+    password = PasswordField('Change Password', validators=[Optional(), Length(min=6, message='This field length must be more 5 characters')])
     submit = SubmitField('Update')
 
     def validate_username(self, username):
@@ -95,4 +96,12 @@ class AdminUserUpdateForm(FlaskForm):
                                               'underscores')])
     email = StringField('Email', validators=[DataRequired(), Email()])
     admin = BooleanField('Admin permission', default="checked")
-    submit = SubmitField('Update')
\ No newline at end of file
+    submit = SubmitField('Update')
+
+class AdminBulkUserForm(FlaskForm):
+    action = SelectField('Action', choices=[('delete', 'Delete users and their posts'),
+                                            ('promote', 'Make admin'),
+                                            ('demote', 'Revoke admin'),
+                                            ('delete_posts', 'Delete their posts')])
+    everything = BooleanField('All users matching the search')
+    submit = SubmitField('Apply')
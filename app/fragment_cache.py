@@ -0,0 +1,135 @@
+"""Cache for rendered template fragments, invalidated by tags.
+
+Every entry records the version of each tag it depends on (``posts`` for
+anything listing posts, ``post:<id>``, ``user:<id>``) and is only served
+while all of them are unchanged. Invalidating a tag just gives it a new
+version, so a post edit drops exactly the pages that showed that post.
+
+Tags are invalidated after a commit that flushed new, changed or deleted
+posts or users, whichever view or Flask-Admin made the change. Bulk
+``Query.update``/``delete`` must call ``invalidate`` themselves.
+
+The ``memory`` backend is private to each process; run several gunicorn
+workers with the shared ``redis`` backend so that they see each other's
+invalidations.
+"""
+import json
+import os
+import pickle
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+
+
+class NullBackend(object):
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set_many(self, mapping, ttl=None):
+        pass
+
+
+class MemoryBackend(NullBackend):
+    def __init__(self, maxsize):
+        self._lru = LRUCache(maxsize=maxsize)
+
+    def get_many(self, keys):
+        return [self._lru.get(key) for key in keys]
+
+    def set_many(self, mapping, ttl=None):
+        for key, value in mapping.items():
+            self._lru.set(key, value, ttl=ttl)
+
+
+class RedisBackend(NullBackend):
+    def __init__(self, url, prefix='fragments:'):
+        import redis
+        self._redis = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        values = self._redis.mget([self.prefix + key for key in keys])
+        return [None if value is None else pickle.loads(value) for value in values]
+
+    def set_many(self, mapping, ttl=None):
+        pipeline = self._redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(self.prefix + key, pickle.dumps(value), ex=ttl or None)
+        pipeline.execute()
+
+
+class FragmentCache(object):
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.ttl = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config['FRAGMENT_CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'])
+        elif backend == 'redis':
+            self.backend = RedisBackend(app.config['FRAGMENT_CACHE_URL'])
+        self.ttl = app.config['FRAGMENT_CACHE_TTL']
+        for name, listener in (('after_flush', self._collect),
+                               ('after_commit', self._invalidate_collected),
+                               ('after_soft_rollback', self._discard_collected)):
+            if not event.contains(Session, name, listener):
+                event.listen(Session, name, listener)
+
+    @staticmethod
+    def key(*parts):
+        return json.dumps(parts, separators=(',', ':'), default=str)
+
+    def get(self, key):
+        entry, = self.backend.get_many([key])
+        if entry is None:
+            return None
+        value, versions = entry
+        if versions:
+            tags = list(versions)
+            current = self.backend.get_many(['tag:' + tag for tag in tags])
+            if any(versions[tag] != version for tag, version in zip(tags, current)):
+                return None
+        return value
+
+    def set(self, key, value, tags=()):
+        tags = list(tags)
+        versions = self.backend.get_many(['tag:' + tag for tag in tags])
+        missing = {}
+        for i, version in enumerate(versions):
+            if version is None:
+                versions[i] = missing['tag:' + tags[i]] = os.urandom(8).hex()
+        missing[key] = (value, dict(zip(tags, versions)))
+        self.backend.set_many(missing, ttl=self.ttl)
+
+    def invalidate(self, *tags):
+        if tags:
+            self.backend.set_many({'tag:' + tag: os.urandom(8).hex() for tag in tags})
+
+    def _collect(self, session, flush_context):
+        from app.models import User, Post
+
+        tags = session.info.setdefault('fragment_cache_tags', set())
+        for instance in session.new:
+            if isinstance(instance, Post):
+                tags.add('posts')
+        for instance in list(session.dirty) + list(session.deleted):
+            identity = inspect(instance).identity
+            if not identity:
+                continue
+            if isinstance(instance, Post):
+                tags.add(f'post:{identity[0]}')
+                if instance in session.deleted:
+                    tags.add('posts')
+            elif isinstance(instance, User):
+                tags.add(f'user:{identity[0]}')
+
+    def _invalidate_collected(self, session):
+        self.invalidate(*session.info.pop('fragment_cache_tags', ()))
+
+    def _discard_collected(self, session, previous_transaction):
+        session.info.pop('fragment_cache_tags', None)
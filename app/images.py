@@ -0,0 +1,159 @@
+"""Profile picture processing off the request thread.
+
+The request only reads the upload into memory and queues it. A bounded pool
+decodes it (JPEGs in draft mode, at the smallest scale that still covers the
+largest output), writes every size in AVATAR_SIZES as JPEG and WebP and then
+points ``User.image_file`` at the result. Until then the user keeps the
+previous picture, ``default.jpg`` for new accounts.
+
+Files are named after a hash of the upload and of the processing settings,
+so identical uploads share one set of files (and skip processing), names
+never change content and can be cached forever, and files nobody
+references any more are removed by ``manage.py database gc_avatars``.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import time
+
+from flask import request
+
+from app import db
+from .pools import BoundedExecutor
+
+log = logging.getLogger(__name__)
+
+# Bump when the output of _write_variants changes for the same input.
+PIPELINE_VERSION = 1
+
+HASHED_NAME = re.compile(r'^(?P<name>[0-9a-f]{32})(?:_\d+)?\.(?:jpg|webp)$')
+GENERATED_NAME = re.compile(r'^(?P<name>[0-9a-f]+)(?:_\d+)?\.(?:jpg|jpeg|png|webp)$')
+
+
+class AvatarPipeline(object):
+    def __init__(self, app=None):
+        self.app = None
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = os.path.join(app.root_path, 'static', 'profile_pics')
+        self.size = app.config['AVATAR_SIZE']
+        self.sizes = sorted(set(app.config['AVATAR_SIZES']) | {self.size}, reverse=True)
+        self.max_pixels = app.config['AVATAR_MAX_PIXELS']
+        self.pool = BoundedExecutor('avatars', app.config['AVATAR_WORKERS'],
+                                    app.config['AVATAR_QUEUE_SIZE'])
+        self.signature = f'v{PIPELINE_VERSION}:{self.size}:{self.sizes}'.encode('ascii')
+        app.after_request(self._cache_headers)
+
+    def filename(self, name, size=None, ext='jpg'):
+        if size is None or size == self.size:
+            return f'{name}.{ext}'
+        return f'{name}_{size}.{ext}'
+
+    def variant(self, image_file, size=None, ext='jpg'):
+        """Name of another size or format of ``image_file``, if it was generated."""
+        filename = self.filename(os.path.splitext(image_file)[0], size, ext)
+        if os.path.exists(os.path.join(self.directory, filename)):
+            return filename
+        return None
+
+    def submit(self, user_id, upload):
+        """Use ``upload`` as the new picture of ``user_id``.
+
+        Pictures that were uploaded before are applied at once, others are
+        queued. Returns whether the picture was queued. Raises ``PoolBusy``
+        when too many pictures are waiting.
+        """
+        data = upload.read()
+        name = hashlib.sha256(self.signature + data).hexdigest()[:32]
+        if all(os.path.exists(os.path.join(self.directory, self.filename(name, size, ext)))
+               for size in self.sizes for ext in ('jpg', 'webp')):
+            self._assign(user_id, name)
+            return False
+        self.pool.submit(self._process, user_id, data, name)
+        return True
+
+    def _process(self, user_id, data, name):
+        try:
+            self._write_variants(data, name)
+        except Exception:
+            log.exception('Could not process the picture of user %s', user_id)
+            return None
+        with self.app.app_context():
+            return self._assign(user_id, name)
+
+    def _assign(self, user_id, name):
+        from app.models import User, user_cache
+        image_file = self.filename(name)
+        User.query.filter_by(id=user_id) \
+            .update({User.image_file: image_file}, synchronize_session=False)
+        db.session.commit()
+        user_cache.invalidate(user_id)
+        return image_file
+
+    def collect_garbage(self, referenced, grace=3600, dry_run=False):
+        """Remove generated pictures whose base name is not in ``referenced``.
+
+        Files younger than ``grace`` seconds are kept, since they may belong
+        to an upload that has not been assigned to its user yet.
+        """
+        keep = {os.path.splitext(image_file)[0] for image_file in referenced if image_file}
+        cutoff = time.time() - grace
+        removed = []
+        for filename in sorted(os.listdir(self.directory)):
+            match = GENERATED_NAME.match(filename)
+            if not match or match.group('name') in keep:
+                continue
+            path = os.path.join(self.directory, filename)
+            if os.path.getmtime(path) > cutoff:
+                continue
+            if not dry_run:
+                os.remove(path)
+            removed.append(filename)
+        return removed
+
+    def _cache_headers(self, response):
+        if request.endpoint == 'static' and response.status_code in (200, 304):
+            filename = (request.view_args or {}).get('filename', '')
+            directory, _, basename = filename.rpartition('/')
+            if directory == 'profile_pics' and HASHED_NAME.match(basename):
+                response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    def _write_variants(self, data, name):
+        from PIL import Image, ImageOps
+
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if width * height > self.max_pixels:
+            raise ValueError(f'{width}x{height} picture is larger than {self.max_pixels} pixels')
+        largest = self.sizes[0]
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+        # Largest first, so every thumbnail is scaled down from the previous one.
+        for size in self.sizes:
+            image.thumbnail((size, size), Image.LANCZOS)
+            self._save(image, self.filename(name, size, 'jpg'), 'JPEG',
+                       quality=85, optimize=True, progressive=True)
+            self._save(image, self.filename(name, size, 'webp'), 'WEBP',
+                       quality=80, method=4)
+
+    def _save(self, image, filename, image_format, **options):
+        path = os.path.join(self.directory, filename)
+        # Unique per call: pool threads may be writing the same file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f'.{filename}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, image_format, **options)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
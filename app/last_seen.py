@@ -0,0 +1,94 @@
+"""Write-behind buffer for ``User.last_seen``.
+
+Requests only note the visit in memory, at most once per user every
+LAST_SEEN_RESOLUTION seconds. A background thread writes everything pending
+in a single batched UPDATE every LAST_SEEN_FLUSH_INTERVAL seconds, and once
+more when the process exits, so page views never open a write transaction.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from app import db
+from app.models import User
+
+log = logging.getLogger(__name__)
+
+
+class LastSeenBuffer(object):
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = {}
+        self._marked = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.resolution = app.config['LAST_SEEN_RESOLUTION']
+        self.interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        atexit.register(self.flush)
+
+    def touch(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            marked = self._marked.get(user_id)
+            if marked is not None and now - marked < self.resolution:
+                return
+            self._marked[user_id] = now
+            self._pending[user_id] = datetime.utcnow()
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        # gunicorn forks workers after the app is imported and threads do
+        # not survive a fork, so every worker starts its own flusher.
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._run, name='last-seen-flusher', daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Could not flush last_seen updates')
+
+    def flush(self):
+        """Write all pending visits; returns the number of users updated."""
+        horizon = time.monotonic() - self.resolution
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._marked = {user_id: marked for user_id, marked in self._marked.items()
+                            if marked > horizon}
+        if not pending:
+            return 0
+
+        table = User.__table__
+        statement = table.update() \
+            .where(table.c.id == bindparam('user_id')) \
+            .values(last_seen=bindparam('seen'))
+        rows = [{'user_id': user_id, 'seen': seen} for user_id, seen in pending.items()]
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(statement, rows)
+        except Exception:
+            # Keep the visits for the next attempt unless newer ones arrived.
+            with self._lock:
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+            raise
+        return len(rows)
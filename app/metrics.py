@@ -0,0 +1,354 @@
+"""Request metrics in the Prometheus text format, at ``/metrics``.
+
+Every gunicorn worker writes its samples to its own memory-mapped file in
+METRICS_DIR, which costs a dict lookup and a ``struct.pack_into`` per value.
+A scrape reaches a single worker, so it reads the files of all of them and
+adds them up. Counters and histograms of workers that have exited are kept
+so that totals never go down; gauges are only reported for live workers.
+
+gunicorn.conf.py empties METRICS_DIR when the server starts.
+
+The metrics describe traffic, latency and workers, so ``/metrics`` answers
+404 except to clients in METRICS_ALLOWED_NETWORKS (loopback by default) or
+with METRICS_TOKEN as a bearer token. Behind a reverse proxy every client
+has the proxy's address, so use the token there.
+"""
+import bisect
+import hmac
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import Response, abort, g, request
+
+from .query_stats import current_stats
+
+INITIAL_SIZE = 64 * 1024
+HEADER = struct.Struct('i4x')
+KEY_LENGTH = struct.Struct('i')
+VALUE = struct.Struct('d')
+
+
+def _padded(length):
+    return length + (-length % 8)
+
+
+class SampleFile(object):
+    """Samples of one process: ``key -> float`` laid out as length, key, value."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        self.path = os.path.join(self.directory, f'{self._pid}.db')
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size == 0:
+            os.ftruncate(fd, INITIAL_SIZE)
+        self._map = mmap.mmap(fd, 0)
+        os.close(fd)
+        self._offsets = {key: offset for key, _, offset in _entries(self._map)}
+        self._used = HEADER.unpack_from(self._map, 0)[0] or HEADER.size
+        HEADER.pack_into(self._map, 0, self._used)
+
+    def _offset(self, key):
+        offset = self._offsets.get(key)
+        if offset is None:
+            encoded = key.encode('utf-8')
+            size = KEY_LENGTH.size + _padded(len(encoded)) + VALUE.size
+            if self._used + size > len(self._map):
+                self._map.resize(max(len(self._map) * 2, self._used + size))
+            KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+            start = self._used + KEY_LENGTH.size
+            self._map[start:start + len(encoded)] = encoded
+            offset = self._used + size - VALUE.size
+            VALUE.pack_into(self._map, offset, 0.0)
+            # Readers only look up to the header, so publish the entry last.
+            self._used += size
+            HEADER.pack_into(self._map, 0, self._used)
+            self._offsets[key] = offset
+        return offset
+
+    def add(self, key, amount):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            offset = self._offset(key)
+            VALUE.pack_into(self._map, offset, VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            VALUE.pack_into(self._map, self._offset(key), value)
+
+
+def _entries(data):
+    used = HEADER.unpack_from(data, 0)[0]
+    position = HEADER.size
+    while position < used:
+        length = KEY_LENGTH.unpack_from(data, position)[0]
+        start = position + KEY_LENGTH.size
+        key = bytes(data[start:start + length]).decode('utf-8')
+        offset = start + _padded(length)
+        yield key, VALUE.unpack_from(data, offset)[0], offset
+        position = offset + VALUE.size
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._keys = {}
+        registry.metrics[name] = self
+
+    def _key(self, values, suffix='', extra=()):
+        cache_key = (values, suffix, extra)
+        key = self._keys.get(cache_key)
+        if key is None:
+            key = self._keys[cache_key] = json.dumps(
+                [self.name + suffix, list(zip(self.labels, values)) + list(extra)])
+        return key
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *values, amount=1):
+        self.registry.samples.add(self._key(values, '_total'), amount)
+
+    def set_total(self, *values, total):
+        """Record this process' own running total, such as a pool's."""
+        self.registry.samples.set(self._key(values, '_total'), total)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *values, amount=1):
+        self.registry.samples.add(self._key(values), amount)
+
+    def dec(self, *values, amount=1):
+        self.registry.samples.add(self._key(values), -amount)
+
+    def set(self, *values, value):
+        self.registry.samples.set(self._key(values), value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=()):
+        super(Histogram, self).__init__(registry, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.bounds = [repr(float(bucket)) for bucket in self.buckets] + ['+Inf']
+
+    def observe(self, *values, value):
+        # Buckets are stored per interval and made cumulative when exposed.
+        bound = self.bounds[bisect.bisect_left(self.buckets, value)]
+        samples = self.registry.samples
+        samples.add(self._key(values, '_bucket', (('le', bound),)), 1)
+        samples.add(self._key(values, '_sum'), value)
+        samples.add(self._key(values, '_count'), 1)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+        self.samples = None
+        self.directory = None
+
+    def configure(self, directory):
+        self.directory = directory
+        self.samples = SampleFile(directory)
+
+    def collect(self):
+        """``{(sample name, labels): value}`` summed over every worker's file."""
+        totals = {}
+        if not os.path.isdir(self.directory):
+            return totals
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.db'):
+                continue
+            alive = _alive(int(filename[:-3]))
+            with open(os.path.join(self.directory, filename), 'rb') as f:
+                data = f.read()
+            if len(data) < HEADER.size:
+                continue
+            for key, value, _ in _entries(data):
+                name, labels = json.loads(key)
+                metric = self._metric_of(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                sample = (name, tuple(tuple(label) for label in labels))
+                totals[sample] = totals.get(sample, 0.0) + value
+        return totals
+
+    def _metric_of(self, sample_name):
+        for suffix in ('', '_total', '_bucket', '_sum', '_count'):
+            if suffix and not sample_name.endswith(suffix):
+                continue
+            metric = self.metrics.get(sample_name[:len(sample_name) - len(suffix)])
+            if metric is not None:
+                return metric
+        return None
+
+    def expose(self):
+        by_metric = {}
+        for sample, value in self.collect().items():
+            by_metric.setdefault(self._metric_of(sample[0]).name, []).append((sample, value))
+        lines = []
+        for metric in self.metrics.values():
+            samples = sorted(by_metric.get(metric.name, ()))
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            if metric.kind == 'histogram':
+                samples = _cumulative(metric, samples)
+            for (name, labels), value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _cumulative(metric, samples):
+    """Running bucket totals, with every bucket present for each label set."""
+    buckets, others = {}, []
+    for (name, labels), value in samples:
+        if name.endswith('_bucket'):
+            series = buckets.setdefault(labels[:-1], {})
+            series[labels[-1][1]] = value
+        else:
+            others.append(((name, labels), value))
+    result = []
+    for labels in sorted(buckets):
+        running = 0.0
+        for bound in metric.bounds:
+            running += buckets[labels].get(bound, 0.0)
+            result.append(((metric.name + '_bucket', labels + (('le', bound),)), running))
+    return result + others
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+registry = Registry()
+
+REQUEST_DURATION = Histogram(
+    registry, 'flask_request_duration_seconds', 'Time spent handling a request.',
+    ('endpoint', 'method', 'status'),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUESTS_IN_FLIGHT = Gauge(
+    registry, 'flask_requests_in_flight', 'Requests being handled right now.')
+REQUEST_DB_DURATION = Histogram(
+    registry, 'flask_request_db_duration_seconds', 'Time a request spent running SQL.',
+    ('endpoint',), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+REQUEST_QUERIES = Counter(
+    registry, 'flask_request_queries', 'SQL statements run by requests.', ('endpoint',))
+POOL_ACTIVE = Gauge(registry, 'pool_active_tasks', 'Tasks running on a worker pool.', ('pool',))
+POOL_QUEUED = Gauge(registry, 'pool_queued_tasks', 'Tasks waiting for a worker pool.', ('pool',))
+POOL_REJECTED = Counter(
+    registry, 'pool_rejected_tasks', 'Tasks refused because a pool was full.', ('pool',))
+
+
+class Metrics(object):
+    def __init__(self, app=None, pools=()):
+        self.registry = registry
+        if app is not None:
+            self.init_app(app, pools)
+
+    def init_app(self, app, pools=()):
+        self.registry.configure(app.config['METRICS_DIR'])
+        self.networks = [ipaddress.ip_network(network.strip(), strict=False)
+                         for network in app.config['METRICS_ALLOWED_NETWORKS'].split(',')
+                         if network.strip()]
+        self.token = app.config['METRICS_TOKEN']
+        app.before_request(self._start)
+        app.after_request(self._record)
+        app.teardown_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+        for pool in pools:
+            pool.observer = self._observe_pool
+            self._observe_pool(pool)
+
+    @staticmethod
+    def _start():
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @staticmethod
+    def _record(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'none'
+        REQUEST_DURATION.observe(endpoint, request.method, str(response.status_code),
+                                 value=time.perf_counter() - started)
+        stats = current_stats()
+        if stats is not None:
+            REQUEST_DB_DURATION.observe(endpoint, value=stats.seconds)
+            REQUEST_QUERIES.inc(endpoint, amount=stats.count)
+        g.metrics_recorded = True
+        return response
+
+    @staticmethod
+    def _finish(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        if not g.pop('metrics_recorded', False):
+            REQUEST_DURATION.observe(request.endpoint or 'none', request.method, '500',
+                                     value=time.perf_counter() - started)
+        REQUESTS_IN_FLIGHT.dec()
+
+    @staticmethod
+    def _observe_pool(pool):
+        POOL_ACTIVE.set(pool.name, value=pool.active)
+        POOL_QUEUED.set(pool.name, value=pool.queue_depth)
+        POOL_REJECTED.set_total(pool.name, total=pool.rejected)
+
+    def _allowed(self):
+        if self.token:
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            # compare_digest only takes ASCII str, so compare the bytes.
+            if scheme.lower() == 'bearer' and hmac.compare_digest(
+                    token.strip().encode('utf-8'), self.token.encode('utf-8')):
+                return True
+        try:
+            address = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            return False
+        return any(address in network for network in self.networks)
+
+    def expose(self):
+        if not self._allowed():
+            abort(404)
+        return Response(self.registry.expose(), mimetype='text/plain; version=0.0.4')
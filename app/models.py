@@ -1,33 +1,41 @@
 from app import db, login
 from datetime import datetime
-from flask_bcrypt import generate_password_hash
-from flask_bcrypt import check_password_hash
 from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from app.passwords import hasher
+from app.user_cache import UserCache
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return user_cache.get(int(id))
 
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
-    image_file = db.Column(db.String(20), nullable=False, default='default.jpg')
+    image_file = db.Column(db.String(64), nullable=False, default='default.jpg')
     about_me = db.Column(db.String(200), nullable=True)
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     password_hash = db.Column(db.String(128))
     admin = db.Column(db.Boolean, default=False)
-    posts = db.relationship('Post', backref='author', lazy='dynamic')
+    # Kept up to date by the Post mapper events below and by app.bulk.
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    posts = db.relationship('Post', backref='author', lazy='dynamic', cascade='all, delete')
 
     def __repr__(self):
         return f'<User {self.username}>'
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password).decode('utf-8')
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not hasher.check(self.password_hash, password):
+            return False
+        if hasher.needs_rehash(self.password_hash):
+            hasher.rehash_later(self.id, self.password_hash, password)
+        return True
 
     def is_admin(self):
         return True if self.admin else False
@@ -39,8 +47,66 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     body = db.Column(db.String(140))
+    # 'text' or 'html'; body_html and excerpt are rendered from body by
+    # set_body, see app.content.
+    body_format = db.Column(db.String(4), nullable=False, default='text', server_default='text')
+    body_html = db.Column(db.Text)
+    excerpt = db.Column(db.String(200))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    update_time = db.Column(db.DateTime, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # What the listings show: the excerpt, or the raw body of rows that have
+    # none (inserted with plain SQL), read in the same query; listings defer
+    # body itself. Undefer it where it is used.
+    summary = db.column_property(db.case([(excerpt.is_(None), body)], else_=excerpt),
+                                 deferred=True)
+
+    # Bumped on every UPDATE; part of the ETag of the post's pages.
+    __mapper_args__ = {'version_id_col': version}
+    # Serves an author's posts newest first (and Post.user_id lookups).
+    __table_args__ = (db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),)
 
     def __repr__(self):
-        return f'<Post {self.body}>'
\ No newline at end of file
+        return f'<Post {self.body}>'
+
+    def set_body(self, body, body_format='text'):
+        """Store ``body`` with its sanitized HTML and excerpt."""
+        from app.content import render_body
+
+        self.body = body
+        self.body_format = body_format
+        self.body_html, self.excerpt = render_body(body, body_format)
+
+
+def count_posts(connection, post, user_id, delta):
+    """Add ``delta`` to the post_count of user ``user_id`` in the flush of ``post``."""
+    if user_id is None:
+        return
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == user_id)
+                       .values(post_count=users.c.post_count + delta))
+    user_cache.mark_changed(object_session(post), user_id)
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_inserted(mapper, connection, post):
+    count_posts(connection, post, post.user_id, 1)
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, post):
+    count_posts(connection, post, post.user_id, -1)
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, connection, post):
+    history = inspect(post).attrs.user_id.history
+    if history.has_changes():
+        for user_id in history.deleted:
+            count_posts(connection, post, user_id, -1)
+        for user_id in history.added:
+            count_posts(connection, post, user_id, 1)
+
+
+user_cache = UserCache(User)
\ No newline at end of file
@@ -1,13 +1,27 @@
-from flask_admin import AdminIndexView
+from flask_admin import Admin, AdminIndexView
 from flask_login import current_user
-from flask import redirect, url_for, request, flash
+from flask import current_app, redirect, url_for, request, flash
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.form import rules
-from flask_ckeditor import CKEditorField
+from flask_ckeditor import CKEditor, CKEditorField
+from sqlalchemy import Column, and_, func, or_
+from sqlalchemy.orm import joinedload
 from wtforms import PasswordField
-from flask_bcrypt import generate_password_hash
 import re
 
+from app import bulk, db
+from app.cache import LRUCache
+from app.models import User, Post
+from app.pagination import beyond, estimated_count
+from app.search import prefix_range
+
+
+def _prefix_match(column, term):
+    # The range is what the index answers; the exact match is for
+    # collations whose order does not keep prefixes together.
+    return and_(prefix_range(column, term), column.startswith(term, autoescape=True))
+
 
 class MyAdminIndexView(AdminIndexView):
     def is_accessible(self):
@@ -16,14 +30,165 @@ class MyAdminIndexView(AdminIndexView):
     def inaccessible_callback(self, name, **kwargs):
         # redirect to login page if user doesn't have access
         req = re.findall(r'[0-9]+(.+)', request.url)[0]
-        return redirect(url_for('login', next=req))
+        return redirect(url_for('main.login', next=req))
     
 
-class UserAdminView(ModelView):
+class ListView(ModelView):
+    """ModelView whose list pages do not slow down as the table grows.
+
+    * Totals follow ADMIN_COUNT: 'exact' counts on every page load,
+      'cached' reuses a count for ADMIN_COUNT_TTL seconds, 'approximate'
+      takes the unfiltered total from ``estimated_count`` and counts
+      searches only up to ADMIN_COUNT_LIMIT rows; beyond that the pager
+      only links the previous and next page.
+    * A search term matches rows whose searchable columns start with it,
+      case-sensitively, through their index instead of Flask-Admin's
+      case-insensitive ``LIKE '%term%'`` scan of the whole table. The list
+      page says so next to the search box.
+    * When this worker showed the previous page, the next one continues
+      after its last row (see ``keyset_paginate``) instead of skipping
+      ``page * page_size`` rows; jumps to other pages still use OFFSET.
+      Only lists sorted by the primary key or a column in
+      ``keyset_columns`` continue this way: comparing past the last row
+      would skip rows whose sort value is NULL, and booleans cannot be
+      compared with ``<`` in SQLAlchemy. Other sorts always use OFFSET.
+    """
+    list_template = 'admin_model_list.html'
+    # Indexed columns the app always sets, which lists can be keyset paged by.
+    keyset_columns = ()
+
+    @property
+    def search_hint(self):
+        return 'Search: start of {} (case-sensitive)'.format(
+            ', '.join(self.get_column_name(name) for name in self.column_searchable_list))
+
+    def __init__(self, *args, **kwargs):
+        super(ListView, self).__init__(*args, **kwargs)
+        # Totals of the list pages, and the sort key of the last row of each
+        # page shown recently, which the next page continues from.
+        self._counts = LRUCache(maxsize=256)
+        self._cursors = LRUCache(maxsize=1024, ttl=600)
+        # Bumped on changes made through this view, to recount.
+        self._generation = 0
+
+    def after_model_change(self, form, model, is_created):
+        self._generation += 1
+
+    def after_model_delete(self, model):
+        self._generation += 1
+
+    def handle_action(self, return_view=None):
+        self._generation += 1
+        return super(ListView, self).handle_action(return_view)
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        for term in search.split():
+            clauses, count_clauses = [], []
+            for field, path in self._search_fields:
+                query, joins, alias = self._apply_path_joins(query, joins, path, inner_join=False)
+                column = field if alias is None else getattr(alias, field.key)
+                clauses.append(_prefix_match(column, term))
+                if count_query is not None:
+                    count_query, count_joins, alias = self._apply_path_joins(
+                        count_query, count_joins, path, inner_join=False)
+                    column = field if alias is None else getattr(alias, field.key)
+                    count_clauses.append(_prefix_match(column, term))
+            query = query.filter(or_(*clauses))
+            if count_query is not None:
+                count_query = count_query.filter(or_(*count_clauses))
+        return query, count_query, joins, count_joins
+
+    def _count(self, query, count_query, filtered):
+        config = current_app.config
+        if config['ADMIN_COUNT'] == 'exact':
+            return count_query.scalar()
+        ttl = config['ADMIN_COUNT_TTL']
+        key = (self._generation, filtered)
+        counted = self._counts.get(key) if ttl else None
+        if counted is None:
+            total = None
+            if config['ADMIN_COUNT'] != 'approximate':
+                total = count_query.scalar()
+            elif filtered:
+                limit = config['ADMIN_COUNT_LIMIT']
+                rows = query.with_entities(getattr(self.model, self._primary_key)) \
+                    .order_by(None).limit(limit + 1).subquery()
+                total = self.session.query(func.count()).select_from(rows).scalar()
+                total = total if total <= limit else None
+            else:
+                total = estimated_count(self.session, self.model)
+                if total is None:
+                    total = count_query.scalar()
+            # Stored in a tuple, so that an unknown total is cached as well.
+            counted = (total,)
+            if ttl:
+                self._counts.set(key, counted, ttl=ttl)
+        return counted[0]
+
+    def _sort_key(self, sort_column, sort_desc):
+        """Columns and direction of the list order, or None if they are not all in the table."""
+        if sort_column is not None:
+            field = self._sortable_columns.get(sort_column)
+            joins = self._sortable_joins.get(sort_column)
+            descending = bool(sort_desc)
+        else:
+            field, joins, descending = self._get_default_order() or (None, None, False)
+        columns = getattr(getattr(field, 'property', None), 'columns', None)
+        column = columns[0] if columns else field
+        if joins or not isinstance(column, Column) or column.table is not self.model.__table__:
+            return None
+        key = getattr(self.model, self._primary_key).property.columns[0]
+        if column is not key and column.key not in self.keyset_columns:
+            return None
+        return ([column] if column is key else [column, key]), descending
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        if page_size is None:
+            page_size = self.page_size
+        joins, count_joins = {}, {}
+        query = self.get_query()
+        count_query = self.get_count_query() if not self.simple_list_pager else None
+        if self._search_supported and search:
+            query, count_query, joins, count_joins = self._apply_search(
+                query, count_query, joins, count_joins, search)
+        if filters and self._filters:
+            query, count_query, joins, count_joins = self._apply_filters(
+                query, count_query, joins, count_joins, filters)
+        filtered = (search, repr(filters)) if search or filters else None
+        count = self._count(query, count_query, filtered) if count_query is not None else None
+        for j in self._auto_joins:
+            query = query.options(joinedload(j))
+
+        sort_key = self._sort_key(sort_column, sort_desc) if execute and page_size else None
+        if sort_key is None:
+            query, joins = self._apply_sorting(query, joins, sort_column, sort_desc)
+            query = self._apply_pagination(query, page, page_size)
+            return count, query.all() if execute else query
+
+        columns, descending = sort_key
+        query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+        state = (self._generation, sort_column, sort_desc, filtered, page_size)
+        cursor = self._cursors.get(state + (page - 1,)) if page else None
+        if cursor is not None:
+            query = query.filter(beyond(columns, cursor, descending))
+        elif page:
+            query = query.offset(page * page_size)
+        items = query.limit(page_size).all()
+        if len(items) == page_size:
+            last = [getattr(items[-1], c.key) for c in columns]
+            if None not in last:
+                self._cursors.set(state + (page,), last)
+        return count, items
+
+
+class UserAdminView(ListView):
     column_searchable_list = ('username',)
     column_sortable_list = ('username', 'admin')
+    column_default_sort = 'id'
+    keyset_columns = ('username',)
     column_exclude_list = ('password_hash',)
-    form_excluded_columns = ('password_hash',)
+    form_excluded_columns = ('password_hash', 'post_count')
     form_edit_rules = ('username', 'admin')
     
     form_edit_rules = (
@@ -43,13 +208,12 @@ class UserAdminView(ModelView):
         return form_class
 
     def create_model(self, form):
-        password_hash = generate_password_hash(form.password.data)
         model = self.model(
         username=form.username.data, email=form.email.data,
         image_file=form.image_file.data, about_me=form.about_me.data,
-        last_seen=form.last_seen.data, password_hash=password_hash,
-        admin=form.admin.data
+        last_seen=form.last_seen.data, admin=form.admin.data
         )
+        model.set_password(form.password.data)
         form.populate_obj(model)
         self.session.add(model)
         self._on_model_change(form, model, True)
@@ -61,28 +225,75 @@ class UserAdminView(ModelView):
             if form.new_password.data != form.confirm.data:
                 flash('Passwords must match', 'warning')
                 return
-            model.password_hash = generate_password_hash(form.new_password.data)
+            model.set_password(form.new_password.data)
         self.session.add(model)
         self._on_model_change(form, model, False)
         self.session.commit()
 
+    # Bulk actions run set-based statements instead of loading every user;
+    # admins cannot delete or demote themselves.
+    @action('delete', 'Delete', 'Delete the selected users and all of their posts?')
+    def action_delete(self, ids):
+        users, posts = bulk.delete_users(ids, keep=current_user.id)
+        flash(f'Deleted {users} users and {posts} posts', 'success')
+
+    @action('promote', 'Make admin', 'Give the selected users admin permission?')
+    def action_promote(self, ids):
+        flash(f'{bulk.set_admin(ids, True)} users are now admins', 'success')
+
+    @action('demote', 'Revoke admin', 'Revoke admin permission from the selected users?')
+    def action_demote(self, ids):
+        flash(f'{bulk.set_admin(ids, False, keep=current_user.id)} users are no longer admins', 'success')
+
+    @action('delete_posts', 'Delete their posts', 'Delete all posts of the selected users?')
+    def action_delete_posts(self, ids):
+        flash(f'Deleted {bulk.delete_posts_by(ids)} posts', 'success')
+
     def is_accessible(self):
         return current_user.is_authenticated and current_user.is_admin()
     
     def inaccessible_callback(self, name, **kwargs):
         # redirect to login page if user doesn't have access
         req = re.findall(r'[0-9]+(.+)', request.url)[0]
-        return redirect(url_for('login', next=req))
+        return redirect(url_for('main.login', next=req))
 
 
-class PostAdminView(ModelView):
+class PostAdminView(ListView):
+    column_exclude_list = ('body_html', 'summary')
+    column_sortable_list = ('timestamp', 'update_time')
+    column_default_sort = ('timestamp', True)
+    keyset_columns = ('timestamp',)
+    form_excluded_columns = ('body_format', 'body_html', 'excerpt', 'version', 'update_time')
     form_overrides = dict(body=CKEditorField)
     create_template = 'edit.html'
     edit_template = 'edit.html'
+
+    def on_model_change(self, form, model, is_created):
+        # CKEditor sends HTML; store it sanitized and pre-rendered.
+        model.set_body(model.body, 'html')
+
+    @action('delete', 'Delete', 'Delete the selected posts?')
+    def action_delete(self, ids):
+        flash(f'Deleted {bulk.delete_posts(ids)} posts', 'success')
+
+    @action('delete_author_posts', 'Delete all posts of their authors',
+            'Delete every post written by the authors of the selected posts?')
+    def action_delete_author_posts(self, ids):
+        flash(f'Deleted {bulk.delete_posts_by(bulk.authors_of(ids))} posts', 'success')
+
     def is_accessible(self):
         return current_user.is_authenticated and current_user.is_admin()
     
     def inaccessible_callback(self, name, **kwargs):
         # redirect to login page if user doesn't have access
         req = re.findall(r'[0-9]+(.+)', request.url)[0]
-        return redirect(url_for('login', next=req))
+        return redirect(url_for('main.login', next=req))
+
+
+def init_admin(app):
+    """Mount Flask-Admin at /admin, with CKEditor for the post bodies."""
+    CKEditor(app)
+    admin = Admin(app, index_view=MyAdminIndexView())
+    admin.add_view(UserAdminView(User, db.session))
+    admin.add_view(PostAdminView(Post, db.session))
+    return admin
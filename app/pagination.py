@@ -0,0 +1,158 @@
+"""Keyset (cursor) pagination, cached and estimated row counts.
+
+A keyset page is fetched with ``WHERE (key) < (last key seen) ORDER BY key
+LIMIT n``, so page 1000 costs the same index range scan as page 1 and no
+``OFFSET`` rows are read and thrown away. Cursors are opaque, URL-safe tokens
+holding the sort key of the row at the page boundary.
+
+``estimated_count`` reads the size of a table from what the database already
+knows about it instead of counting its rows.
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import Integer, and_, func, inspect, or_, text
+
+from .cache import LRUCache
+
+_counts = LRUCache(maxsize=1024)
+
+
+class KeysetPage(object):
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values):
+    values = [{'dt': value.isoformat()} if isinstance(value, datetime) else value
+              for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Sort key stored in ``cursor``, or None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+        return [datetime.strptime(value['dt'], '%Y-%m-%dT%H:%M:%S.%f'
+                                  if '.' in value['dt'] else '%Y-%m-%dT%H:%M:%S')
+                if isinstance(value, dict) else value
+                for value in values]
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def beyond(columns, values, descending):
+    # (a, b) < (x, y) spelled out as a < x OR (a = x AND b < y), which every
+    # database can turn into a range scan on an (a, b) index.
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*(equal + [column < values[i] if descending else column > values[i]])))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, columns, per_page, after=None, before=None, descending=True):
+    """Page of ``query`` ordered by ``columns`` (the last one must be unique).
+
+    ``after`` continues past the cursor of a previous page's last row,
+    ``before`` goes back from the cursor of its first row.
+    """
+    cursor = decode_cursor(after or before or '')
+    if cursor is not None and len(cursor) != len(columns):
+        cursor = None
+    backwards = cursor is not None and not after
+    order = descending != backwards
+    if cursor is not None:
+        query = query.filter(beyond(columns, cursor, order))
+    query = query.order_by(*[c.desc() if order else c.asc() for c in columns])
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+
+    def key(item):
+        return encode_cursor([getattr(item, c.key) for c in columns])
+
+    next_cursor = prev_cursor = None
+    if items:
+        if more or backwards:
+            next_cursor = key(items[-1])
+        if (more and backwards) or (cursor is not None and not backwards):
+            prev_cursor = key(items[0])
+    return KeysetPage(items, per_page, next_cursor, prev_cursor)
+
+
+def cached_count(key, query, ttl=None):
+    """``query.count()``, reused for ``ttl`` seconds (POSTS_COUNT_TTL by default).
+
+    Returns None when counting is disabled with a TTL of 0.
+    """
+    if ttl is None:
+        ttl = current_app.config['POSTS_COUNT_TTL']
+    if not ttl:
+        return None
+    total = _counts.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        _counts.set(key, total, ttl=ttl)
+    return total
+
+
+def _sqlite_rows(connection, table):
+    # An INTEGER PRIMARY KEY is the rowid: its maximum is read from the end
+    # of the table's b-tree and only overcounts deleted rows, while the
+    # ANALYZE statistics in sqlite_stat1 can be arbitrarily old.
+    key = list(table.primary_key)
+    if len(key) == 1 and isinstance(key[0].type, Integer):
+        return connection.scalar(func.max(key[0])) or 0
+    has_stats = connection.scalar(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"))
+    stat = has_stats and connection.scalar(
+        text('SELECT stat FROM sqlite_stat1 WHERE tbl = :name LIMIT 1'), name=table.name)
+    return int(stat.split()[0]) if stat else None
+
+
+def _postgresql_rows(connection, table):
+    # Updated by VACUUM, ANALYZE and autovacuum; -1 (or 0) before the first.
+    rows = connection.scalar(
+        text('SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)'),
+        name=table.fullname)
+    return int(rows) if rows and rows > 0 else None
+
+
+def _mysql_rows(connection, table):
+    # InnoDB's estimate from sampled index pages, typically within 10-50%.
+    return connection.scalar(text(
+        'SELECT TABLE_ROWS FROM information_schema.TABLES '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name'), name=table.name)
+
+
+_estimators = {'sqlite': _sqlite_rows, 'postgresql': _postgresql_rows, 'mysql': _mysql_rows}
+
+
+def estimated_count(session, model):
+    """Approximate number of rows of ``model``'s table, read in constant time.
+
+    Returns None when the database has no estimate (other dialects, a
+    PostgreSQL table that was never analyzed).
+    """
+    connection = session.connection(mapper=inspect(model))
+    estimator = _estimators.get(connection.dialect.name)
+    return estimator(connection, model.__table__) if estimator else None
@@ -0,0 +1,75 @@
+"""Password hashing on a small dedicated pool.
+
+bcrypt is slow on purpose, so a login burst used to keep every worker
+thread busy hashing. Hashes now run on PASSWORD_HASH_WORKERS threads; up to
+PASSWORD_HASH_QUEUE_SIZE more wait their turn and anything beyond that fails
+fast with ``PoolBusy`` (503) instead of queueing without bound.
+
+Hashes made with a cost other than BCRYPT_LOG_ROUNDS are upgraded in the
+background after the next successful login.
+"""
+import re
+from concurrent.futures import TimeoutError
+
+from app import db, bcrypt
+from .pools import BoundedExecutor, PoolBusy
+
+BCRYPT_COST = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+
+class PasswordHasher(object):
+    def __init__(self, app=None):
+        self.app = None
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.pool = BoundedExecutor('hashing', app.config['PASSWORD_HASH_WORKERS'],
+                                    app.config['PASSWORD_HASH_QUEUE_SIZE'])
+
+    def hash(self, password):
+        return self._run(self._hash, password)
+
+    def check(self, pw_hash, password):
+        if not pw_hash:
+            return False
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        match = BCRYPT_COST.match(pw_hash or '')
+        return match is None or int(match.group(1)) != self.rounds
+
+    def rehash_later(self, user_id, pw_hash, password):
+        """Replace ``pw_hash`` with one of the configured cost, off the request."""
+        try:
+            self.pool.submit(self._rehash, user_id, pw_hash, password)
+        except PoolBusy:
+            pass  # The next login will try again.
+
+    def _run(self, fn, *args):
+        future = self.pool.submit(fn, *args)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise PoolBusy(self.pool.name)
+
+    def _hash(self, password):
+        return bcrypt.generate_password_hash(password, self.rounds).decode('utf-8')
+
+    def _rehash(self, user_id, old_hash, password):
+        from app.models import User, user_cache
+
+        new_hash = self._hash(password)
+        with self.app.app_context():
+            # Only if the password was not changed in the meantime.
+            User.query.filter_by(id=user_id, password_hash=old_hash) \
+                .update({User.password_hash: new_hash}, synchronize_session=False)
+            db.session.commit()
+        user_cache.invalidate(user_id)
+
+
+hasher = PasswordHasher()
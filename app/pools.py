@@ -0,0 +1,97 @@
+"""Bounded thread pools for CPU-heavy work done on behalf of requests."""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolBusy(Exception):
+    """The pool's queue is full; the caller should shed the request."""
+
+    def __init__(self, pool, retry_after=1):
+        super(PoolBusy, self).__init__(f'{pool} pool is busy')
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class BoundedExecutor(object):
+    """``ThreadPoolExecutor`` that refuses work instead of queueing without limit.
+
+    At most ``workers`` tasks run at once and ``queue_size`` more may wait;
+    ``submit`` raises ``PoolBusy`` beyond that.
+    """
+
+    def __init__(self, name, workers, queue_size):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.active = 0
+        self.wait_seconds = 0.0
+        # Called with the pool whenever its counters change.
+        self.observer = None
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def queue_depth(self):
+        return self.submitted - self.completed - self.active
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            self._notify()
+            raise PoolBusy(self.name)
+        queued_at = time.monotonic()
+
+        def run():
+            with self._lock:
+                self.active += 1
+                self.wait_seconds += time.monotonic() - queued_at
+            self._notify()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                self._slots.release()
+                self._notify()
+
+        try:
+            with self._lock:
+                future = self._get_executor().submit(run)
+                self.submitted += 1
+        except Exception:
+            self._slots.release()
+            raise
+        self._notify()
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'queue_size': self.queue_size,
+                    'active': self.active, 'queued': self.queue_depth,
+                    'submitted': self.submitted, 'completed': self.completed,
+                    'rejected': self.rejected, 'wait_seconds': self.wait_seconds}
+
+    def _notify(self):
+        if self.observer is not None:
+            self.observer(self)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=wait)
+        self._executor = None
+
+    def _get_executor(self):
+        # Threads do not survive gunicorn's fork, so each worker gets its own.
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+            self._pid = os.getpid()
+        return self._executor
@@ -0,0 +1,86 @@
+"""cProfile of single requests, written to PROFILE_DIR as pstats files.
+
+An admin profiles a request by adding ``?_profile=1`` or an
+``X-Profile: 1`` header; the response names the file in ``X-Profile-File``.
+PROFILE_SAMPLE (``main.posts:100,main.post:500``) also profiles one in N
+requests of each listed endpoint, whoever makes them.
+
+Read the files with ``python -m pstats`` or turn them into a flame graph
+with snakeviz or flameprof. Without PROFILE_DIR no hooks are installed.
+"""
+import cProfile
+import itertools
+import logging
+import os
+import time
+
+from flask import g, request
+from flask_login import current_user
+
+log = logging.getLogger(__name__)
+
+
+def parse_sample(spec):
+    """``'main.posts:100,main.post:500'`` -> ``{'main.posts': 100, 'main.post': 500}``."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        endpoint, _, every = item.rpartition(':')
+        rates[endpoint] = int(every)
+    return rates
+
+
+class RequestProfiler(object):
+    def __init__(self, app=None):
+        self.directory = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config['PROFILE_DIR']
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.rates = parse_sample(app.config['PROFILE_SAMPLE'])
+        self._counters = {endpoint: itertools.count(1) for endpoint in self.rates}
+        app.before_request(self._start)
+        app.after_request(self._name_file)
+        app.teardown_request(self._stop)
+
+    def _requested(self):
+        if request.args.get('_profile') != '1' and request.headers.get('X-Profile') != '1':
+            return False
+        return current_user.is_authenticated and current_user.is_admin()
+
+    def _sampled(self):
+        counter = self._counters.get(request.endpoint)
+        return counter is not None and next(counter) % self.rates[request.endpoint] == 0
+
+    def _start(self):
+        sampled = self._sampled()
+        requested = self._requested()
+        if not (sampled or requested):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return  # Another request of this process is being profiled.
+        g.profile = profile
+        g.profile_requested = requested
+        g.profile_file = os.path.join(self.directory, '{}-{}-{}.pstats'.format(
+            request.endpoint or 'none', time.strftime('%Y%m%dT%H%M%S'), os.urandom(3).hex()))
+
+    @staticmethod
+    def _name_file(response):
+        if g.get('profile') is not None and g.profile_requested:
+            response.headers['X-Profile-File'] = os.path.basename(g.profile_file)
+        return response
+
+    @staticmethod
+    def _stop(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        profile.dump_stats(g.profile_file)
+        log.info('Profiled %s %s into %s', request.method, request.path, g.profile_file)
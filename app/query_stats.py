@@ -0,0 +1,122 @@
+"""Per-request SQL statistics and query budgets.
+
+Every statement run while handling a request is counted and timed, and the
+slowest one is remembered. Each request logs one line with the totals; in
+debug mode (or with QUERY_STATS_HEADERS) they are also sent back as
+``X-Query-Count``, ``X-Query-Time`` (milliseconds) and ``X-Query-Slowest``.
+
+Views declare how many statements they may run with ``@query_budget(n)``.
+Going over raises ``QueryBudgetExceeded`` when TESTING is set, so an N+1
+fails the tests, and only logs a warning otherwise.
+"""
+import logging
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestQueryStats(object):
+    __slots__ = ('count', 'seconds', 'slowest', 'slowest_seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = None
+        self.slowest_seconds = 0.0
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if seconds >= self.slowest_seconds:
+            self.slowest = statement
+            self.slowest_seconds = seconds
+
+
+def current_stats():
+    """Statistics of the current request, or None outside of one."""
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+class QueryStats(object):
+    def __init__(self, app=None):
+        self.headers = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.headers = app.debug or app.config['QUERY_STATS_HEADERS']
+        app.before_request(self._start)
+        app.after_request(self._report)
+        # Engine events are global; a second app must not count queries twice.
+        for name, listener in (('before_cursor_execute', self._before_execute),
+                               ('after_cursor_execute', self._after_execute),
+                               ('handle_error', self._failed)):
+            if not event.contains(Engine, name, listener):
+                event.listen(Engine, name, listener)
+
+    @staticmethod
+    def _start():
+        g.query_stats = RequestQueryStats()
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        stats = current_stats()
+        if stats is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+    @staticmethod
+    def _failed(context):
+        started = context.connection.info.get('query_started') if context.connection else None
+        if started:
+            started.pop()
+
+    def _report(self, response):
+        stats = current_stats()
+        if stats is None:
+            return response
+        log.info('%s %s %s: %d queries in %.1f ms, slowest %.1f ms: %s',
+                 request.method, request.full_path.rstrip('?'), response.status_code,
+                 stats.count, stats.seconds * 1000, stats.slowest_seconds * 1000,
+                 ' '.join((stats.slowest or '').split())[:200])
+        if self.headers:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time'] = f'{stats.seconds * 1000:.2f}'
+            response.headers['X-Query-Slowest'] = f'{stats.slowest_seconds * 1000:.2f}'
+        return response
+
+
+def query_budget(limit):
+    """Allow the decorated view at most ``limit`` statements per request.
+
+    The count includes everything run since the request started, such as
+    loading the logged in user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+            stats = current_stats()
+            if stats is not None and stats.count > limit:
+                message = f'{request.endpoint} ran {stats.count} queries, its budget is {limit}'
+                if current_app.testing:
+                    raise QueryBudgetExceeded(message)
+                log.warning(message)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,237 @@
+"""Admission control and rate limits for the CPU-heavy endpoints.
+
+Login, registration and account updates spend tens to hundreds of
+milliseconds on bcrypt or Pillow. ``RateLimiter.limit`` sheds their excess
+load before any of that work starts:
+
+* Token buckets per client IP and per account answer 429 with the number
+  of seconds until the next token in ``Retry-After``.
+* At most RATELIMIT_CONCURRENCY requests of an endpoint run at once across
+  all gunicorn workers; the rest get an immediate 503 rather than a place
+  in a queue, so cheap pages keep their workers.
+
+Workers share state through files in RATELIMIT_DIR. The buckets live in one
+memory-mapped table locked with ``fcntl``; a concurrency slot is an
+``flock`` on one of RATELIMIT_CONCURRENCY files per endpoint, which the
+kernel releases even when a worker dies holding it.
+
+Client IPs are taken from ``request.remote_addr``. Behind a reverse proxy,
+wrap the app in werkzeug's ProxyFix so that it is the client's address.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import random
+import re
+import struct
+import threading
+import time
+from functools import wraps
+
+from flask import request
+from flask_login import current_user
+
+# Key hash, tokens left, time of the last update.
+SLOT = struct.Struct('Qdd')
+SLOTS = 16384
+PROBES = 8
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+RATE = re.compile(r'^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*$')
+
+
+class RateLimited(Exception):
+    """A token bucket is empty; answered with 429."""
+
+    def __init__(self, retry_after):
+        super(RateLimited, self).__init__('rate limit exceeded')
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """Every concurrency slot of the endpoint is taken; answered with 503."""
+
+    def __init__(self, endpoint, retry_after=1):
+        super(Overloaded, self).__init__(f'{endpoint} is overloaded')
+        self.retry_after = retry_after
+
+
+def parse_rate(rate):
+    """'10/minute' -> (tokens per second, bucket size)."""
+    match = RATE.match(rate)
+    if match is None:
+        raise ValueError(f'Invalid rate {rate!r}, expected e.g. 10/minute')
+    count = int(match.group(1))
+    return count / PERIODS[match.group(2)], count
+
+
+class TokenBuckets(object):
+    """Token buckets of all workers in a fixed-size, memory-mapped hash table.
+
+    A key lives in one of PROBES slots after its hash. When all of them are
+    taken, the least recently used one is reused; its key starts over with
+    a full bucket, which errs on the side of letting requests through.
+    """
+
+    def __init__(self, path, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < self.slots * SLOT.size:
+            os.ftruncate(self._fd, self.slots * SLOT.size)
+        self._map = mmap.mmap(self._fd, self.slots * SLOT.size)
+        self._pid = os.getpid()
+
+    def take(self, key, rate, burst, now=None):
+        """Take a token from the bucket of ``key``.
+
+        Returns 0 on success, otherwise the seconds until a token is available.
+        """
+        digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(),
+                                'little') or 1
+        now = time.time() if now is None else now
+        start = digest % self.slots
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            # lockf only excludes other processes; _lock the other threads.
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                offset, tokens, updated = self._find(digest, start)
+                if updated:
+                    tokens = min(burst, tokens + (now - updated) * rate)
+                else:
+                    tokens = burst
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / rate
+                SLOT.pack_into(self._map, offset, digest, tokens, now)
+                return wait
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, digest, start):
+        """Offset, tokens and last update of ``digest``'s slot; 0 for a new one."""
+        oldest = None
+        for probe in range(PROBES):
+            offset = (start + probe) % self.slots * SLOT.size
+            stored, tokens, updated = SLOT.unpack_from(self._map, offset)
+            if stored == digest:
+                return offset, tokens, updated
+            if stored == 0:
+                return offset, 0.0, 0.0
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        return oldest[0], 0.0, 0.0
+
+
+class ConcurrencyLimit(object):
+    """At most ``limit`` holders at once across processes, one ``flock``ed file per slot."""
+
+    def __init__(self, directory, name, limit):
+        self.directory = directory
+        self.name = name
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # flock belongs to the open file, so every slot gets its own
+        # descriptor and at most one thread of this process uses it.
+        self._fds = [os.open(os.path.join(self.directory, f'{self.name}.{slot}.lock'),
+                             os.O_RDWR | os.O_CREAT, 0o644)
+                     for slot in range(self.limit)]
+        self._free = list(range(self.limit))
+        self._pid = os.getpid()
+
+    def acquire(self):
+        """Index of the slot taken, or None when all of them are busy."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            random.shuffle(self._free)
+            for slot in self._free:
+                try:
+                    fcntl.flock(self._fds[slot], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._free.remove(slot)
+                return slot
+        return None
+
+    def release(self, slot):
+        with self._lock:
+            fcntl.flock(self._fds[slot], fcntl.LOCK_UN)
+            self._free.append(slot)
+
+
+def current_account():
+    return current_user.get_id() if current_user.is_authenticated else None
+
+
+class RateLimiter(object):
+    def __init__(self, app=None):
+        self.enabled = False
+        self._limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RATELIMIT_ENABLED']
+        self.directory = app.config['RATELIMIT_DIR']
+        self.concurrency = app.config['RATELIMIT_CONCURRENCY']
+        self.buckets = TokenBuckets(os.path.join(self.directory, 'buckets'))
+
+    def limit(self, per_ip=None, per_account=None, account=current_account, methods=('POST',)):
+        """Limit the ``methods`` requests of a view.
+
+        ``per_ip`` and ``per_account`` are rates such as '10/minute', which
+        also allow bursts of that many requests. ``account()`` names the
+        account a request is for, or returns None to skip that bucket.
+        """
+        ip_rate = parse_rate(per_ip) if per_ip else None
+        account_rate = parse_rate(per_account) if per_account else None
+
+        def decorator(view):
+            @wraps(view)
+            def limited(*args, **kwargs):
+                if not self.enabled or request.method not in methods:
+                    return view(*args, **kwargs)
+                endpoint = request.endpoint
+                if ip_rate:
+                    self._take(f'{endpoint}:ip:{request.remote_addr}', ip_rate)
+                if account_rate:
+                    name = account()
+                    if name:
+                        self._take(f'{endpoint}:account:{name}', account_rate)
+                limit = self._limit(endpoint)
+                slot = limit.acquire()
+                if slot is None:
+                    raise Overloaded(endpoint)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    limit.release(slot)
+            return limited
+        return decorator
+
+    def _take(self, key, rate):
+        wait = self.buckets.take(key, *rate)
+        if wait:
+            raise RateLimited(max(1, math.ceil(wait)))
+
+    def _limit(self, endpoint):
+        limit = self._limits.get(endpoint)
+        if limit is None:
+            limit = self._limits.setdefault(
+                endpoint, ConcurrencyLimit(self.directory, endpoint, self.concurrency))
+        return limit
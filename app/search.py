@@ -0,0 +1,171 @@
+"""Full-text search over posts.
+
+Every backend keeps its index inside the database, so posts written from the
+views, Flask-Admin or raw SQL are indexed without any application hooks:
+
+* SQLite - an external-content FTS5 table kept in sync by triggers,
+* PostgreSQL - a GIN index over a tsvector expression,
+* MySQL - a FULLTEXT index on (title, body).
+
+Anything else falls back to the old LIKE scan. SQLite batch migrations that
+recreate the ``post`` table drop the triggers, so run
+``manage.py database rebuild_search_index`` after them.
+"""
+import re
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, text, func, literal_column, table, column, false, and_
+
+from app import db
+from app.models import Post
+
+
+class LikeSearch(object):
+    name = 'like'
+
+    def create(self, connection):
+        pass
+
+    def drop(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def search(self, query, q):
+        return query.filter(Post.title.contains(q) | Post.body.contains(q)) \
+            .order_by(Post.timestamp.desc())
+
+
+class SQLiteSearch(LikeSearch):
+    name = 'sqlite'
+
+    fts = table('post_fts', column('rowid'), column('rank'))
+
+    ddl = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+        "title, body, content='post', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post BEGIN "
+        "INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post BEGIN "
+        "INSERT INTO post_fts(post_fts, rowid, title, body) "
+        "VALUES ('delete', old.id, old.title, old.body); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF title, body ON post BEGIN "
+        "INSERT INTO post_fts(post_fts, rowid, title, body) "
+        "VALUES ('delete', old.id, old.title, old.body); "
+        "INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body); "
+        "END",
+    )
+
+    def create(self, connection):
+        for statement in self.ddl:
+            connection.execute(text(statement))
+
+    def drop(self, connection):
+        for name in ('post_fts_ai', 'post_fts_ad', 'post_fts_au'):
+            connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+        connection.execute(text('DROP TABLE IF EXISTS post_fts'))
+
+    def rebuild(self, connection):
+        connection.execute(text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')"))
+
+    def search(self, query, q):
+        # Quote every word so FTS5 operators in user input are taken
+        # literally; the last word is a prefix to match while typing.
+        words = re.findall(r'\w+', q)
+        if not words:
+            return query.filter(false())
+        expression = ' '.join(f'"{word}"' for word in words) + '*'
+        return query.join(self.fts, self.fts.c.rowid == Post.id) \
+            .filter(literal_column('post_fts').match(expression)) \
+            .order_by(self.fts.c.rank, Post.timestamp.desc())
+
+
+class PostgresSearch(LikeSearch):
+    name = 'postgresql'
+
+    # Must stay textually identical to the indexed expression, otherwise the
+    # planner will not use ix_post_fts.
+    document = "to_tsvector('simple', coalesce(post.title, '') || ' ' || coalesce(post.body, ''))"
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_post_fts ON post USING gin "
+            "(to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(body, '')))"))
+
+    def drop(self, connection):
+        connection.execute(text('DROP INDEX IF EXISTS ix_post_fts'))
+
+    def rebuild(self, connection):
+        connection.execute(text('REINDEX INDEX ix_post_fts'))
+
+    def search(self, query, q):
+        document = literal_column(self.document)
+        ts_query = func.plainto_tsquery('simple', q)
+        return query.filter(document.op('@@')(ts_query)) \
+            .order_by(func.ts_rank(document, ts_query).desc(), Post.timestamp.desc())
+
+
+class MySQLSearch(LikeSearch):
+    name = 'mysql'
+
+    def create(self, connection):
+        exists = connection.execute(text(
+            "SELECT COUNT(*) FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = 'post' "
+            "AND index_name = 'ix_post_fts'")).scalar()
+        if not exists:
+            connection.execute(text('CREATE FULLTEXT INDEX ix_post_fts ON post (title, body)'))
+
+    def rebuild(self, connection):
+        connection.execute(text('OPTIMIZE TABLE post'))
+
+    def search(self, query, q):
+        match = 'MATCH (post.title, post.body) AGAINST (:q IN NATURAL LANGUAGE MODE)'
+        return query.filter(text(match).bindparams(q=q)) \
+            .order_by(text(match + ' DESC').bindparams(q=q), Post.timestamp.desc())
+
+
+BACKENDS = {backend.name: backend for backend in
+            (LikeSearch, SQLiteSearch, PostgresSearch, MySQLSearch)}
+
+
+def get_backend(dialect_name=None):
+    name = None
+    if has_app_context():
+        name = current_app.config.get('SEARCH_BACKEND')
+    if not name:
+        name = dialect_name or db.engine.dialect.name
+    return BACKENDS.get(name, LikeSearch)()
+
+
+def search_posts(q, query=None):
+    """Posts matching ``q``, most relevant first."""
+    if query is None:
+        query = Post.query
+    return get_backend().search(query, q)
+
+
+def prefix_range(column, prefix):
+    """``column`` starts with ``prefix``, as a range its index can scan."""
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def rebuild_index():
+    with db.engine.begin() as connection:
+        backend = get_backend(connection.dialect.name)
+        backend.create(connection)
+        backend.rebuild(connection)
+    return backend.name
+
+
+@event.listens_for(Post.__table__, 'after_create')
+def _create_index(target, connection, **kw):
+    get_backend(connection.dialect.name).create(connection)
+
+
+@event.listens_for(Post.__table__, 'before_drop')
+def _drop_index(target, connection, **kw):
+    get_backend(connection.dialect.name).drop(connection)
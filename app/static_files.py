@@ -0,0 +1,104 @@
+"""Fingerprinted, precompressed copies of the files in app/static.
+
+``manage.py build_static`` copies every file under app/static (except the
+uploaded profile pictures) to app/static/dist with a hash of its content in
+the name, writes ``.gz`` and, with the brotli package, ``.br`` versions of
+the compressible ones and records the names in dist/manifest.json.
+
+Once the manifest exists, ``url_for('static', filename='styles/style.css')``
+points at the fingerprinted copy. Those names change whenever the content
+does, so they are served with a one-year immutable Cache-Control, in the
+best precompressed encoding the client accepts.
+
+webassets (pinned with Flask-Assets) is not used for this. It bundles and
+filters assets declared in templates, but does not precompress files or
+version images, and the app declares no bundles.
+"""
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+
+from flask import request, send_from_directory
+
+from .compression import brotli, choose_encoding
+
+DIST = 'dist'
+SKIP = ('dist', 'profile_pics')
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.map', '.ico', '.xml')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def build(static_folder):
+    """Rebuild static_folder/dist; returns the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        relative_root = os.path.relpath(root, static_folder)
+        if relative_root.split(os.sep)[0] in SKIP:
+            dirs[:] = []
+            continue
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(name)
+            fingerprinted = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            logical = posixpath.normpath(posixpath.join(relative_root.replace(os.sep, '/'), name))
+            target = posixpath.join(DIST, posixpath.dirname(logical), fingerprinted)
+            path = os.path.join(static_folder, *target.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            if ext.lower() in COMPRESSIBLE:
+                with open(path + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9))
+                if brotli is not None:
+                    with open(path + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+            manifest[logical] = target
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticFiles(object):
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.static_folder
+        path = os.path.join(self.folder, DIST, 'manifest.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+        app.url_defaults(self._fingerprint)
+        app.after_request(self._serve_dist)
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == 'static' and self.manifest:
+            filename = posixpath.normpath(values.get('filename', '').lstrip('/'))
+            values['filename'] = self.manifest.get(filename, values.get('filename'))
+
+    def _serve_dist(self, response):
+        filename = (request.view_args or {}).get('filename', '')
+        if request.endpoint != 'static' or not filename.startswith(DIST + '/') \
+                or response.status_code not in (200, 304):
+            return response
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding)
+        if response.status_code == 200 and suffix \
+                and os.path.exists(os.path.join(self.folder, *(filename + suffix).split('/'))):
+            mimetype = response.mimetype
+            response.close()
+            response = send_from_directory(self.folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+        if os.path.splitext(filename)[1].lower() in COMPRESSIBLE:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
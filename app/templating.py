@@ -0,0 +1,90 @@
+"""Compiled templates shared by all workers.
+
+Jinja compiles a template to Python code the first time a worker renders
+it, around 130 ms for the site, admin and API templates together, paid
+again by every worker after each deploy. ``TemplateCache`` keeps the
+compiled code in TEMPLATE_CACHE_DIR (by default instance/template-cache),
+where ``manage.py compile_templates`` fills it at deploy time; loading all
+templates from there takes a few milliseconds. With TEMPLATES_PRELOAD a
+worker loads every template while it starts, so its first requests render
+as fast as later ones, and TEMPLATES_AUTO_RELOAD=False (ProductionConfig)
+stops Jinja from checking the template files for changes on every render.
+
+Cached code is keyed by the template's name and checked against a hash of
+its source and the Jinja and Python versions, so an edited template or an
+upgrade is recompiled rather than served stale.
+"""
+import logging
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+
+logger = logging.getLogger(__name__)
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache safe for several processes writing at once.
+
+    Files are written under a temporary name and renamed into place, so a
+    worker never reads another one's half-written file, and a directory
+    that cannot be written to only costs the compilation.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            fd, path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        except OSError as e:
+            logger.warning('Cannot write to the template cache: %s', e)
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.chmod(path, 0o644)
+            os.replace(path, self._get_cache_filename(bucket))
+        except BaseException:
+            os.remove(path)
+            raise
+
+
+class TemplateCache(object):
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        directory = app.config['TEMPLATE_CACHE_DIR'] or \
+            os.path.join(app.instance_path, 'template-cache')
+        os.makedirs(directory, exist_ok=True)
+        self.cache = SharedBytecodeCache(directory)
+        app.jinja_env.bytecode_cache = self.cache
+
+    def load_all(self, app):
+        """Load every template of the app and its blueprints.
+
+        Returns the names loaded and ``(name, error)`` for those that do
+        not compile.
+        """
+        env = app.jinja_env
+        loaded, failed = [], []
+        for name in env.list_templates():
+            try:
+                env.get_template(name)
+            except TemplateSyntaxError as e:
+                failed.append((name, e))
+            else:
+                loaded.append(name)
+        return loaded, failed
+
+    def preload(self, app):
+        loaded, failed = self.load_all(app)
+        for name, error in failed:
+            logger.warning('Template %s does not compile: %s', name, error)
+        return loaded
+
+    def compile(self, app):
+        """Recompile every template into an emptied cache."""
+        self.cache.clear()
+        app.jinja_env.cache.clear()
+        return self.load_all(app)
@@ -0,0 +1,86 @@
+"""Per-process cache for the Flask-Login user loader.
+
+Only column values are cached. On a hit they are turned back into an
+instance and merged into the current session with ``load=False``, so the
+request gets a normal persistent ``User`` without a SELECT.
+
+Entries are dropped when a committed session flushed changes to that user,
+which covers the account page, the admin routes and Flask-Admin. Bulk
+``Query.update``/``delete`` bypass the session and must call
+``invalidate`` themselves. Other workers see a change after at most
+USER_CACHE_TTL seconds.
+"""
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app import db
+from .cache import LRUCache
+
+
+class UserCache(object):
+    def __init__(self, model, app=None):
+        self.model = model
+        self._cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        ttl = app.config['USER_CACHE_TTL']
+        if ttl:
+            self._cache = LRUCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=ttl)
+        for name, listener in (('after_flush', self._collect),
+                               ('after_commit', self._invalidate_collected),
+                               ('after_soft_rollback', self._discard_collected)):
+            if not event.contains(Session, name, listener):
+                event.listen(Session, name, listener)
+
+    def get(self, user_id):
+        if self._cache is None:
+            return self.model.query.get(user_id)
+        state = self._cache.get(user_id)
+        if state is None:
+            user = self.model.query.get(user_id)
+            if user is not None:
+                self._cache.set(user_id, self._snapshot(user))
+            return user
+        user = self.model(**state)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, *user_ids):
+        if self._cache is not None:
+            for user_id in user_ids:
+                self._cache.delete(user_id)
+
+    def mark_changed(self, session, *user_ids):
+        """Invalidate ``user_ids`` when ``session`` commits.
+
+        For changes written with SQL inside a flush, which the session does
+        not see as changes to the users.
+        """
+        session.info.setdefault('user_cache_changed', set()).update(user_ids)
+
+    def clear(self):
+        if self._cache is not None:
+            self._cache.clear()
+
+    def stats(self):
+        if self._cache is None:
+            return {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 0}
+        return self._cache.stats()
+
+    def _snapshot(self, user):
+        return {attr.key: getattr(user, attr.key)
+                for attr in inspect(self.model).column_attrs}
+
+    def _collect(self, session, flush_context):
+        for instance in list(session.dirty) + list(session.deleted):
+            identity = inspect(instance).identity
+            if isinstance(instance, self.model) and identity:
+                self.mark_changed(session, identity[0])
+
+    def _invalidate_collected(self, session):
+        self.invalidate(*session.info.pop('user_cache_changed', ()))
+
+    def _discard_collected(self, session, previous_transaction):
+        session.info.pop('user_cache_changed', None)
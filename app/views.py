@@ -1,30 +1,46 @@
+import csv
+import io
+import json
 from functools import wraps
 from urllib.parse import urlparse, urljoin
 
-from flask import render_template, redirect, flash, url_for, request, abort
-from app import app, db
+from flask import Blueprint, render_template, redirect, flash, url_for, request, abort, Markup, \
+    make_response, Response, stream_with_context, current_app
+from app import db, last_seen, avatars, fragment_cache, bulk, limiter
 from .forms import RegistrationForm, LoginForm, UpdateAccountForm, PostCreationForm, PostEditingForm, \
-    AdminUserUpdateForm, AdminUserCreateForm
+    AdminUserUpdateForm, AdminUserCreateForm, AdminBulkUserForm
 from .models import User, Post
+from .search import search_posts, prefix_range
+from .pagination import keyset_paginate, cached_count
+from .pools import PoolBusy
+from .ratelimit import RateLimited, Overloaded
+from .conditional import make_etag, not_modified, set_validators
+from .query_stats import query_budget
+from .database import read_replica
+from flask_sqlalchemy import Pagination
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, defer, undefer
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.urls import url_parse
-import os
-import secrets
-from PIL import Image
 from datetime import datetime
 
+bp = Blueprint('main', __name__)
+
 ROWS_PER_PAGE = 3
+# Listings show Post.summary; the full bodies are only loaded by the post page.
+LISTING_COLUMNS = (defer(Post.body), defer(Post.body_html), undefer(Post.summary))
 
-@app.route('/')
-@app.route('/index')
+@bp.route('/')
+@bp.route('/index')
 def show_main_page():
 	return render_template('index.html')
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
+@limiter.limit(per_ip='10/hour')
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('show_main_page'))
+        return redirect(url_for('main.show_main_page'))
     reg_form = RegistrationForm()
     if reg_form.validate_on_submit():
         username = reg_form.username.data
@@ -37,14 +53,20 @@ def register():
         db.session.commit()
         # Make flash message
         flash(f'Account created for {user.username}', 'info')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template('register.html', form=reg_form)
 
-@app.route('/login', methods=['GET', 'POST'])
+
+def login_email():
+    return request.form.get('email', '').strip().lower() or None
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit(per_ip='30/minute', per_account='10/minute', account=login_email)
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('posts'))
+        return redirect(url_for('main.posts'))
 
     login_form = LoginForm()
     if login_form.validate_on_submit():
@@ -59,7 +81,7 @@ def login():
             next_url = request.args.get('next')
             
             if not next_url or url_parse(next_url).netloc != '':
-                next_url = url_for('show_main_page')
+                next_url = url_for('main.show_main_page')
             return redirect(next_url)
 
         else:
@@ -67,34 +89,117 @@ def login():
         
     return render_template('login.html', form=login_form)
 
-@app.route('/posts', methods=['GET'])
+def cached_fragment(key, load, template):
+    """Render ``template`` through the fragment cache.
+
+    ``load()`` returns the template context, the ids of the users whose
+    posts are shown and the cache tags. The fragment only depends on the
+    viewer through the Edit/Delete buttons, so a viewer shares the cached
+    copy of everyone who owns none of the shown posts.
+    """
+    viewer = current_user.id if current_user.is_authenticated else None
+    owners = fragment_cache.get(fragment_cache.key(*key, 'owners'))
+    if owners is not None:
+        variant = viewer if viewer in owners else None
+        fragment = fragment_cache.get(fragment_cache.key(*key, variant))
+        if fragment is not None:
+            return Markup(fragment)
+
+    context, owners, tags = load()
+    variant = viewer if viewer in owners else None
+    fragment = render_template(template, **context)
+    fragment_cache.set(fragment_cache.key(*key, 'owners'), tuple(owners), tags)
+    fragment_cache.set(fragment_cache.key(*key, variant), fragment, tags)
+    return Markup(fragment)
+
+
+def post_tags(posts):
+    tags = {f'post:{post.id}' for post in posts}
+    tags.update(f'user:{post.user_id}' for post in posts)
+    return sorted(tags)
+
+
+@bp.route('/posts', methods=['GET'])
 @login_required
+@query_budget(4)
+@read_replica
 def posts():
     q = request.args.get('q')
     page = request.args.get('page', 1, type=int)
-    if q:
-        posts = Post.query.filter(Post.title.contains(q) | Post.body.contains(q))
-    else:
-        posts = Post.query.order_by(Post.timestamp.desc())
+    if page < 1:
+        abort(404)
+    cursor_mode = not q and current_app.config['POSTS_PAGINATION'] == 'keyset' and 'page' not in request.args
+
+    def select(query):
+        if q:
+            query = search_posts(q, query)
+        if cursor_mode:
+            return keyset_paginate(query, (Post.timestamp, Post.id), ROWS_PER_PAGE,
+                                   after=request.args.get('after'),
+                                   before=request.args.get('before'))
+        if not q:
+            query = query.order_by(Post.timestamp.desc(), Post.id.desc())
+        return query.limit(ROWS_PER_PAGE).offset((page - 1) * ROWS_PER_PAGE).all()
+
+    # Total pages are only needed for page links; count once per TTL.
+    total = cached_count(('posts', q), search_posts(q) if q else Post.query)
+    if total is None and not cursor_mode:
+        total = (search_posts(q) if q else Post.query).order_by(None).count()
+
+    # The same page as bare versions first: enough to answer a revalidation
+    # without loading or rendering the posts.
+    rows = select(db.session.query(Post.id, Post.timestamp, Post.update_time,
+                                   Post.version, User.username).outerjoin(Post.author))
+    if cursor_mode:
+        rows = rows.items
+    etag = make_etag(request.full_path, current_user.id, total,
+                     [(row.id, row.version, row.username) for row in rows])
+    last_modified = max((row.update_time for row in rows if row.update_time), default=None)
+    response = not_modified(etag, last_modified, use_last_modified=False)
+    if response is not None:
+        return response
+
+    def load():
+        items = select(Post.query.options(joinedload(Post.author), *LISTING_COLUMNS))
+        if cursor_mode:
+            pages = items
+            pages.total = total
+        else:
+            pages = Pagination(None, page, ROWS_PER_PAGE, total, items)
+        context = dict(pages=pages, q=q, cursor_mode=cursor_mode)
+        return context, {post.user_id for post in pages.items}, ['posts'] + post_tags(pages.items)
 
-    pages = posts.paginate(page=page, per_page=ROWS_PER_PAGE)
-    return render_template('posts.html', posts=posts, pages=pages, q=q)
+    fragment = cached_fragment(('posts', request.full_path), load, '_posts.html')
+    response = make_response(render_template('posts.html', fragment=fragment, q=q))
+    return set_validators(response, etag, last_modified)
 
-@app.route('/post/<int:id>')
+@bp.route('/post/<int:id>')
+@query_budget(3)
+@read_replica
 def post(id):
-    post = Post.query.filter_by(id=id).first()
-    return render_template('post.html', post=post)
+    row = db.session.query(Post.version, Post.update_time, User.username) \
+        .outerjoin(Post.author).filter(Post.id == id).first_or_404()
+    etag = make_etag('post', id, current_user.get_id(), row.version, row.username)
+    response = not_modified(etag, row.update_time)
+    if response is not None:
+        return response
+
+    def load():
+        post = Post.query.options(joinedload(Post.author)).filter_by(id=id).first_or_404()
+        return dict(post=post), {post.user_id}, post_tags([post])
 
+    fragment = cached_fragment(('post', id), load, '_post.html')
+    response = make_response(render_template('post.html', fragment=fragment))
+    return set_validators(response, etag, row.update_time)
 
-@app.route('/create_post', methods=['GET', 'POST'])
+
+@bp.route('/create_post', methods=['GET', 'POST'])
 @login_required
 def create_post():
     form = PostCreationForm()
     if form.validate_on_submit():
-        post_title = form.post_title.data
-        post_body = form.post_body.data
-
-        post = Post(title=post_title, body=post_body, author=current_user)
+        post = Post(title=form.post_title.data, author=current_user)
+        post.set_body(form.post_body.data)
 
         db.session.add(post)
         db.session.commit()
@@ -102,90 +207,112 @@ def create_post():
     return render_template('create_post.html', form=form)
 
 
-@app.route('/edit_post/<int:id>', methods=['GET', 'POST'])
+@bp.route('/edit_post/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_post(id):
     form = PostEditingForm()
-    post = Post.query.filter_by(id=id).first()
+    post = Post.query.get_or_404(id)
+    if post.user_id != current_user.id:
+        return redirect(url_for('main.post', id=id))
     if form.validate_on_submit():
-        if current_user.username != post.author.username:
-            return redirect(url_for('main'))
         post.title = form.post_title.data
-        post.body = form.post_body.data
+        # Posts written in the admin are HTML; keep them so.
+        post.set_body(form.post_body.data, post.body_format)
         post.update_time = datetime.utcnow()
 
         db.session.commit()
         flash("Post edited successfully")
 
     elif request.method == 'GET':
-        if current_user.username != post.author.username:
-            return redirect(url_for('main'))
         form.post_title.data = post.title
         form.post_body.data = post.body
     return render_template('edit_post.html', form=form, post=post)
 
 
-@app.route('/delete_post/<int:id>', methods=["GET", "DELETE"])
+@bp.route('/delete_post/<int:id>', methods=["GET", "DELETE"])
 @login_required
 def delete_post(id):
-    post = Post.query.filter_by(id=id).first()
-    if current_user.username != post.author.username:
-        return redirect(url_for('main'))
+    post = Post.query.get_or_404(id)
+    if post.user_id != current_user.id:
+        return redirect(url_for('main.post', id=id))
 
     db.session.delete(post)
     db.session.commit()
-    return redirect(url_for('posts'))
+    return redirect(url_for('main.posts'))
 
 
-@app.route('/logout')
+@bp.route('/user/<username>')
+@query_budget(3)
+@read_replica
+def user_posts(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    # Newest first on the (user_id, timestamp) index; the total is the
+    # stored post_count, so the page needs no COUNT(*).
+    pages = keyset_paginate(Post.query.options(*LISTING_COLUMNS).filter(Post.user_id == user.id),
+                            (Post.timestamp, Post.id),
+                            ROWS_PER_PAGE, after=request.args.get('after'),
+                            before=request.args.get('before'))
+    pages.total = user.post_count
+    return render_template('user.html', user=user, pages=pages)
+
+
+@bp.route('/logout')
 def logout():
     logout_user()
     flash('Logged out', 'info')
-    return redirect(url_for('show_main_page'))
+    return redirect(url_for('main.show_main_page'))
 
 
-@app.route('/account', methods=['GET', 'POST'])
+@bp.route('/account', methods=['GET', 'POST'])
 @login_required
+@limiter.limit(per_ip='30/minute', per_account='10/minute')
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
         if form.picture.data:
-            picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file 
+            try:
+                if avatars.submit(current_user.id, form.picture.data):
+                    flash('Your new picture will appear in a moment', 'info')
+            except PoolBusy:
+                flash('Too many pictures are being processed, please try again later', 'warning')
         current_user.username = form.username.data
         current_user.email = form.email.data
         current_user.about_me = form.about_me.data
-        current_user.set_password(form.password.data)
+        # Hashing is the slowest part of the request; skip it unless the
+        # password was actually changed.
+        if form.password.data:
+            current_user.set_password(form.password.data)
         db.session.commit()
         flash('Your account has been updated!', 'success')
-        return redirect(url_for('account'))
+        return redirect(url_for('main.account'))
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.email.data = current_user.email
         form.about_me.data = current_user.about_me
-        form.password.data = current_user.password_hash
 
     image_file = url_for('static', filename=f'profile_pics/{current_user.image_file}')
-    return render_template('account.html', title='Account', image=image_file, form=form)
-
-def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
-    name, ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + ext
-    picture_path = os.path.join(app.root_path, 'static/profile_pics', picture_fn)
-    
-    output_size = (120, 120)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-
-    return picture_fn
-
-@app.before_request
+    image_webp = avatars.variant(current_user.image_file, ext='webp')
+    if image_webp:
+        image_webp = url_for('static', filename=f'profile_pics/{image_webp}')
+    return render_template('account.html', title='Account', image=image_file,
+                           image_webp=image_webp, form=form)
+
+@bp.before_app_request
 def before_request():
-    if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+    if request.endpoint != 'static' and current_user.is_authenticated:
+        last_seen.touch(current_user.id)
+
+@bp.app_errorhandler(PoolBusy)
+@bp.app_errorhandler(Overloaded)
+def pool_busy(error):
+    return 'The server is busy, please try again in a moment.', 503, \
+        {'Retry-After': str(error.retry_after)}
+
+
+@bp.app_errorhandler(RateLimited)
+def rate_limited(error):
+    return 'Too many requests, please try again later.', 429, \
+        {'Retry-After': str(error.retry_after)}
 
 def is_safe_url(target):
     ref_url = urlparse(request.host_url)
@@ -202,22 +329,82 @@ def admin_login_required(func):
     return decorated_view
 
 
-@app.route('/admin/')
+@bp.route('/admin/')
 @login_required
 @admin_login_required
 def home_admin():
     return render_template('admin_home.html')
 
 
-@app.route('/admin/users/')
+USERS_PER_PAGE = 50
+USER_SORTS = {'id': User.id, 'username': User.username, 'last_seen': User.last_seen}
+USER_COLUMNS = (User.id, User.username, User.email, User.admin, User.last_seen, User.post_count)
+
+
+def admin_user_query(args=None):
+    """Users matching the ``q``, ``sort`` and ``order`` of the request, as column tuples."""
+    args = request.args if args is None else args
+    q = args.get('q', '').strip()
+    sort = args.get('sort', 'id')
+    descending = args.get('order') == 'desc'
+    column = USER_SORTS.get(sort, User.id)
+    query = db.session.query(*USER_COLUMNS)
+    if q:
+        query = query.filter(or_(prefix_range(User.username, q), prefix_range(User.email, q)))
+    order = [column, User.id] if column is not User.id else [User.id]
+    return query.order_by(*[c.desc() if descending else c for c in order])
+
+
+@bp.route('/admin/users/')
 @login_required
 @admin_login_required
+@query_budget(3)
 def users_list_admin():
-    users = User.query.all()
-    return render_template('admin_users_list.html', users=users)
-
-
-@app.route('/admin/users/create/', methods=['POST', 'GET'])
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
+    query = admin_user_query()
+    q = request.args.get('q', '').strip()
+    total = cached_count(('users', q), query, ttl=current_app.config['ADMIN_COUNT_TTL'])
+    if total is None:
+        total = query.order_by(None).count()
+    users = query.limit(USERS_PER_PAGE).offset((page - 1) * USERS_PER_PAGE).all()
+    pages = Pagination(None, page, USERS_PER_PAGE, total, users)
+    return render_template('admin_users_list.html', pages=pages, q=q, bulk_form=AdminBulkUserForm(),
+                           sort=request.args.get('sort', 'id'), order=request.args.get('order', 'asc'))
+
+
+@bp.route('/admin/users/export.<any(csv, jsonl):fmt>')
+@login_required
+@admin_login_required
+def users_export_admin(fmt):
+    """Every matching user, streamed without loading them all at once."""
+    fields = [column.key for column in USER_COLUMNS]
+    rows = admin_user_query().yield_per(1000)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(fields)
+        for i, row in enumerate(rows, 1):
+            values = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+            if fmt == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(fields, values))) + '\n')
+            if i % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=users.{fmt}'})
+
+
+@bp.route('/admin/users/create/', methods=['POST', 'GET'])
 @login_required
 @admin_login_required
 def user_create_admin():
@@ -232,12 +419,12 @@ def user_create_admin():
         db.session.add(user)
         db.session.commit()
         flash(f'User {user.username} has been successfully created!', 'success')
-        return redirect(url_for('home_admin'))
+        return redirect(url_for('main.home_admin'))
 
     return render_template('admin_create_user.html', form=form)
 
 
-@app.route('/admin/users/<int:user_id>/update/', methods=['POST', 'GET'])
+@bp.route('/admin/users/<int:user_id>/update/', methods=['POST', 'GET'])
 @login_required
 @admin_login_required
 def user_update_admin(user_id):
@@ -253,7 +440,7 @@ def user_update_admin(user_id):
 
         db.session.commit()
         flash(f'User {user.username} has been successfully updated', 'success')
-        return redirect(url_for('home_admin'))
+        return redirect(url_for('main.home_admin'))
 
     elif request.method == 'GET':
         form.username.data = user.username
@@ -262,13 +449,37 @@ def user_update_admin(user_id):
     return render_template('admin_update_user.html', form=form, user=user)
 
 
-@app.route('/admin/users/<int:user_id>/delete/', methods=['GET'])
+@bp.route('/admin/users/<int:user_id>/delete/', methods=['GET'])
 @login_required
 @admin_login_required
 def user_delete_admin(user_id):
-    user = User.query.get(user_id)
+    user = User.query.get_or_404(user_id)
     username = user.username
-    db.session.delete(user)
-    db.session.commit()
+    # Also deletes the user's posts, which used to be left without an author.
+    bulk.delete_users([user_id])
     flash(f'User {username} has been successfully deleted!', 'success')
-    return redirect(url_for('home_admin'))
\ No newline at end of file
+    return redirect(url_for('main.home_admin'))
+
+
+@bp.route('/admin/users/bulk/', methods=['POST'])
+@login_required
+@admin_login_required
+def users_bulk_admin():
+    form = AdminBulkUserForm()
+    if form.validate_on_submit():
+        if form.everything.data:
+            ids = [user_id for user_id, in admin_user_query(request.form).with_entities(User.id)]
+        else:
+            ids = request.form.getlist('ids', type=int)
+        if form.action.data == 'delete':
+            users, posts = bulk.delete_users(ids, keep=current_user.id)
+            flash(f'Deleted {users} users and {posts} posts', 'success')
+        elif form.action.data == 'promote':
+            flash(f'{bulk.set_admin(ids, True)} users are now admins', 'success')
+        elif form.action.data == 'demote':
+            flash(f'{bulk.set_admin(ids, False, keep=current_user.id)} users are no longer admins',
+                  'success')
+        else:
+            flash(f'Deleted {bulk.delete_posts_by(ids)} posts', 'success')
+    return redirect(url_for('main.users_list_admin', q=request.form.get('q'),
+                            sort=request.form.get('sort'), order=request.form.get('order')))
\ No newline at end of file
@@ -0,0 +1,346 @@
+"""Route-level load benchmark.
+
+Seeds a throwaway SQLite database with synthetic data, drives the real
+routes through the Flask test client (or a local gunicorn) and reports
+throughput, latency percentiles and SQL queries per request as JSON:
+
+    python -m benchmarks.routes --users 1000 --posts 20000 --out bench.json
+    python -m benchmarks.routes --baseline bench.json --fail-on-regression
+    python -m benchmarks.routes --gunicorn --workers 4 --concurrency 8
+
+Query counts come from the X-Query-Count header, which the benchmark turns
+on with QUERY_STATS_HEADERS. Rate limits are switched off, since every
+request comes from one client and account. Under gunicorn the
+``account_post`` route writes its pictures to app/static/profile_pics;
+``manage.py database gc_avatars`` removes them afterwards.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'benchmark'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per route')
+    parser.add_argument('--routes', help='comma-separated subset of routes to run')
+    parser.add_argument('--database', help='reuse this SQLite file instead of seeding a new one')
+    parser.add_argument('--gunicorn', action='store_true', help='drive a local gunicorn over HTTP')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads with --gunicorn')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --out')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative p95 slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    return parser.parse_args(argv)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, queries, errors):
+    latencies = latencies or [0.0]
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'queries_mean': None,
+        'queries_max': None,
+    }
+    if queries:
+        result['queries_mean'] = round(sum(queries) / len(queries), 2)
+        result['queries_max'] = max(queries)
+    return result
+
+
+def picture():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), (random.randrange(256), 80, 160)).save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+def seed(app, args):
+    """Create and fill the benchmark database; returns the fixtures the routes need."""
+    from app import db
+    from app.models import User, Post
+    from app.pagination import encode_cursor
+    from flask_database import load_synthetic_data
+
+    with app.app_context():
+        if not args.database:
+            db.create_all()
+            load_synthetic_data(args.users, args.posts, seed=args.seed, password=PASSWORD)
+        admin = User.query.order_by(User.id).first()
+        admin.admin = True
+        db.session.commit()
+        post_ids = [post_id for post_id, in db.session.query(Post.id)]
+        total = len(post_ids)
+        deep = Post.query.order_by(Post.timestamp.desc(), Post.id.desc()) \
+            .offset(int(total * 0.9)).first()
+        fixtures = {
+            'email': admin.email,
+            'username': admin.username,
+            'post_ids': post_ids,
+            'deep_cursor': encode_cursor([deep.timestamp, deep.id]) if deep else '',
+            'deep_page': max(1, int(total * 0.9) // 3),
+            'authors': [username for username, in db.session.query(User.username)
+                        .order_by(User.post_count.desc()).limit(20)],
+            'words': ['weather', 'hope', 'life', 'news', 'world', 'market', 'family'],
+        }
+        db.session.remove()
+    return fixtures
+
+
+def routes(fixtures):
+    """name -> (method, path factory, form data factory, needs login)."""
+    def account_form():
+        return {'username': fixtures['username'], 'email': fixtures['email'],
+                'about_me': 'benchmark', 'password': '',
+                'picture': (picture(), 'picture.jpg')}
+
+    return {
+        'posts': ('GET', lambda: '/posts', None, True),
+        'posts_search': ('GET', lambda: f"/posts?q={random.choice(fixtures['words'])}", None, True),
+        'posts_deep_cursor': ('GET', lambda: f"/posts?after={fixtures['deep_cursor']}", None, True),
+        'posts_deep_page': ('GET', lambda: f"/posts?page={fixtures['deep_page']}", None, True),
+        'post': ('GET', lambda: f"/post/{random.choice(fixtures['post_ids'])}", None, True),
+        'user_feed': ('GET', lambda: f"/user/{random.choice(fixtures['authors'])}", None, True),
+        'login': ('POST', lambda: '/login',
+                  lambda: {'email': fixtures['email'], 'password': PASSWORD}, False),
+        'account_post': ('POST', lambda: '/account', account_form, True),
+        'admin_users': ('GET', lambda: '/admin/users/', None, True),
+    }
+
+
+def run_test_client(app, args, fixtures, selected):
+    from app import avatars, query_stats, limiter
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    # Keep the uploaded pictures out of app/static.
+    avatars.directory = tempfile.mkdtemp(prefix='bench-avatars-')
+    query_stats.headers = True
+    limiter.enabled = False
+
+    def logged_in():
+        client = app.test_client()
+        client.post('/login', data={'email': fixtures['email'], 'password': PASSWORD})
+        return client
+
+    session = logged_in()
+    results = {}
+    for name, (method, path, data, needs_login) in selected.items():
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for i in range(args.warmup + args.requests):
+            client = session if needs_login else app.test_client()
+            begin = time.perf_counter()
+            if method == 'GET':
+                response = client.get(path())
+            else:
+                response = client.post(path(), data=data(), content_type='multipart/form-data')
+            latency = time.perf_counter() - begin
+            if i == args.warmup - 1:
+                started = time.perf_counter()
+            if i < args.warmup:
+                continue
+            latencies.append(latency)
+            queries.append(int(response.headers.get('X-Query-Count', 0)))
+            errors += response.status_code >= 400
+        results[name] = summarize(latencies, time.perf_counter() - started, queries, errors)
+        print(f"{name:>18}: {results[name]['p50_ms']:8.2f} ms p50 "
+              f"{results[name]['p95_ms']:8.2f} ms p95 "
+              f"{results[name]['queries_mean']} queries", file=sys.stderr)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def csrf_token(http, url):
+    match = CSRF_TOKEN.search(http.get(url).text)
+    return match.group(1) if match else ''
+
+
+def run_gunicorn(app, args, fixtures, selected):
+    import requests
+
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{port}',
+         'wsgi:app'], cwd=ROOT, env=dict(os.environ, QUERY_STATS_HEADERS='1', RATELIMIT_ENABLED='0'))
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                requests.get(base + '/', timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.2)
+
+        def logged_in():
+            http = requests.Session()
+            http.post(base + '/login', data={'email': fixtures['email'], 'password': PASSWORD,
+                                             'csrf_token': csrf_token(http, base + '/login')})
+            return http
+
+        results = {}
+        for name, (method, path, data, needs_login) in selected.items():
+            latencies, queries, lock = [], [], threading.Lock()
+            errors = [0]
+            warmup = -(-args.warmup // args.concurrency)
+            measured = -(-args.requests // args.concurrency)
+            # Every thread logs in and warms up before the clock starts.
+            ready = threading.Barrier(args.concurrency + 1)
+
+            def request(client):
+                url = base + path()
+                fields = files = None
+                if method == 'POST':
+                    form = data()
+                    # The test client takes (file, name), requests (name, file).
+                    files = {key: value[::-1] for key, value in form.items()
+                             if isinstance(value, tuple)}
+                    fields = {key: value for key, value in form.items() if key not in files}
+                    fields['csrf_token'] = csrf_token(client, url)
+                begin = time.perf_counter()
+                try:
+                    response = client.request(method, url, data=fields, files=files or None)
+                except requests.RequestException:
+                    return time.perf_counter() - begin, None
+                return time.perf_counter() - begin, response
+
+            def worker():
+                http = None
+                try:
+                    http = logged_in()
+                    for _ in range(warmup):
+                        request(http if needs_login else requests.Session())
+                finally:
+                    ready.wait()
+                for _ in range(measured):
+                    latency, response = request(http if needs_login else requests.Session())
+                    with lock:
+                        latencies.append(latency)
+                        if response is None:
+                            errors[0] += 1
+                            continue
+                        queries.append(int(response.headers.get('X-Query-Count', 0)))
+                        errors[0] += response.status_code >= 400
+
+            threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+            for thread in threads:
+                thread.start()
+            ready.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            results[name] = summarize(latencies, time.perf_counter() - started, queries, errors[0])
+            print(f"{name:>18}: {results[name]['p50_ms']:8.2f} ms p50 "
+                  f"{results[name]['p95_ms']:8.2f} ms p95", file=sys.stderr)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(results, baseline, threshold):
+    """Lines describing every route, and whether any of them regressed."""
+    lines, regressed = [], False
+    for name, current in results['routes'].items():
+        before = baseline.get('routes', {}).get(name)
+        if not before:
+            lines.append(f'{name:>18}: new')
+            continue
+        change = current['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+        worse = change > threshold
+        # Background work (avatar assignment) adds a little noise to the counts.
+        if current['queries_mean'] is not None and before.get('queries_mean') is not None \
+                and current['queries_mean'] > before['queries_mean'] * 1.1:
+            worse = True
+        regressed = regressed or worse
+        lines.append(f"{name:>18}: p95 {before['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms "
+                     f"({change:+.0%}), queries {before.get('queries_mean')} -> "
+                     f"{current['queries_mean']}{'  REGRESSION' if worse else ''}")
+    return lines, regressed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    database = args.database or os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database)
+    sys.path.insert(0, ROOT)
+    random.seed(args.seed)
+    from app import create_app
+
+    app = create_app()
+    fixtures = seed(app, args)
+    available = routes(fixtures)
+    names = args.routes.split(',') if args.routes else list(available)
+    selected = {name: available[name] for name in names}
+    run = run_gunicorn if args.gunicorn else run_test_client
+    results = {
+        'meta': {
+            'created': datetime.utcnow().isoformat(timespec='seconds'),
+            'mode': 'gunicorn' if args.gunicorn else 'test_client',
+            'users': args.users, 'posts': args.posts, 'seed': args.seed,
+            'requests': args.requests, 'python': platform.python_version(),
+        },
+        'routes': run(app, args, fixtures, selected),
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines, regressed = compare(results, json.load(f), args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        if regressed and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
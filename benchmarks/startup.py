@@ -0,0 +1,147 @@
+"""Startup-time benchmark.
+
+Measures, in fresh interpreters, how long importing the app package and
+calling ``create_app()`` take, which every gunicorn worker and every test
+process pays, and which top-level packages the time goes to (from
+``python -X importtime``, Python 3.7+):
+
+    python -m benchmarks.startup --out startup.json
+    python -m benchmarks.startup --env ADMIN_ENABLED=0 --env API_ENABLED=0
+    python -m benchmarks.startup --baseline startup.json --fail-on-regression
+
+A run regresses when the median startup is more than --threshold slower
+than the baseline, or when a package of at least --min-package ms is
+imported that the baseline did not import.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, time, warnings
+warnings.simplefilter('ignore')
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'create_app_ms': (created - imported) * 1000}))
+'''
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help='timed interpreter starts')
+    parser.add_argument('--top', type=int, default=15, help='packages listed in the report')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='set in the measured interpreters, e.g. ADMIN_ENABLED=0')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --out')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--min-package', type=float, default=5.0,
+                        help='ms from which a newly imported package is a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    return parser.parse_args(argv)
+
+
+def start(env, importtime=False):
+    """Timings of one fresh interpreter and, with ``importtime``, its stderr."""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD]
+    process = subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+
+def packages(importtime_output):
+    """Import ms per top-level package, from ``-X importtime`` output.
+
+    Sums the self time of every module, so a package's dependencies are
+    listed under their own names instead of being counted twice.
+    """
+    totals = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(own) / 1000
+    return totals
+
+
+def measure(args):
+    env = dict(os.environ)
+    env.update(item.split('=', 1) for item in args.env)
+    runs = [start(env)[0] for _ in range(args.repeat)]
+    _, output = start(env, importtime=True)
+    imports = packages(output)
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    create_ms = statistics.median(run['create_app_ms'] for run in runs)
+    return {
+        'meta': {
+            'created': datetime.utcnow().isoformat(timespec='seconds'),
+            'env': args.env, 'repeat': args.repeat, 'python': platform.python_version(),
+        },
+        'import_ms': round(import_ms, 1),
+        'create_app_ms': round(create_ms, 1),
+        'startup_ms': round(import_ms + create_ms, 1),
+        'packages': {name: round(ms, 1) for name, ms in
+                     sorted(imports.items(), key=lambda item: item[1], reverse=True)},
+    }
+
+
+def report(results, top):
+    lines = [f"startup {results['startup_ms']:.1f} ms: import {results['import_ms']:.1f} ms, "
+             f"create_app {results['create_app_ms']:.1f} ms"]
+    for name, ms in list(results['packages'].items())[:top]:
+        lines.append(f'{name:>24}: {ms:8.1f} ms')
+    return lines
+
+
+def compare(results, baseline, threshold, min_package):
+    """Lines describing the differences, and whether startup regressed."""
+    before = baseline['startup_ms']
+    change = results['startup_ms'] / before - 1 if before else 0
+    regressed = change > threshold
+    lines = [f"startup {before:.1f} -> {results['startup_ms']:.1f} ms ({change:+.0%})"
+             f"{'  REGRESSION' if regressed else ''}"]
+    for name, ms in results['packages'].items():
+        if name not in baseline.get('packages', {}) and ms >= min_package:
+            regressed = True
+            lines.append(f'{name:>24}: {ms:8.1f} ms  NEW IMPORT')
+    return lines, regressed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = measure(args)
+    print('\n'.join(report(results, args.top)), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines, regressed = compare(results, json.load(f), args.threshold, args.min_package)
+        print('\n'.join(lines), file=sys.stderr)
+        if regressed and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import os
+import tempfile
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config(object):
@@ -6,3 +7,116 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional read replica for the read-only pages, e.g. a copy of app.db
+    # made with 'manage.py database clone_replica'.
+    SQLALCHEMY_BINDS = {'replica': os.environ['REPLICA_DATABASE_URL']} \
+        if os.environ.get('REPLICA_DATABASE_URL') else None
+    # Connection pool of server databases (PostgreSQL, MySQL).
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    SQLALCHEMY_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    # SQLite files: WAL lets readers and the last_seen writer run at once.
+    # Sizes are in bytes, a negative cache size in KiB per connection.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -16000)
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE') or 5)
+    # Full-text search backend for posts: 'sqlite', 'postgresql', 'mysql' or
+    # 'like'. Defaults to the one matching the database dialect.
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+    # 'keyset' pages the /posts feed by (timestamp, id) cursors, 'offset'
+    # keeps numbered pages. Searches are ranked and always use numbered pages.
+    POSTS_PAGINATION = os.environ.get('POSTS_PAGINATION') or 'keyset'
+    # Seconds a post count is reused for page totals. 0 hides the total in
+    # keyset mode and recounts on every numbered page.
+    POSTS_COUNT_TTL = int(os.environ.get('POSTS_COUNT_TTL') or 60)
+    # User.last_seen is recorded at most once per user every
+    # LAST_SEEN_RESOLUTION seconds and written in batches every
+    # LAST_SEEN_FLUSH_INTERVAL seconds.
+    LAST_SEEN_RESOLUTION = int(os.environ.get('LAST_SEEN_RESOLUTION') or 60)
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 10)
+    # Seconds a user loaded for Flask-Login is reused by this worker, and how
+    # many users it keeps. A TTL of 0 disables the cache.
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 30)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+    # Profile pictures are resized in the background to every size in
+    # AVATAR_SIZES; AVATAR_SIZE is the one stored in User.image_file.
+    AVATAR_SIZE = 120
+    AVATAR_SIZES = (60, 120, 240)
+    AVATAR_MAX_PIXELS = int(os.environ.get('AVATAR_MAX_PIXELS') or 40000000)
+    AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS') or 2)
+    AVATAR_QUEUE_SIZE = int(os.environ.get('AVATAR_QUEUE_SIZE') or 16)
+    # Rendered post fragments: 'memory' (per worker), 'redis' (shared by all
+    # workers, at FRAGMENT_CACHE_URL) or 'null' to disable.
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND') or 'memory'
+    FRAGMENT_CACHE_URL = os.environ.get('FRAGMENT_CACHE_URL') or 'redis://localhost:6379/0'
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 2048)
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL') or 300)
+    # bcrypt cost; existing hashes are upgraded on the next login. Hashing
+    # runs on PASSWORD_HASH_WORKERS threads with a bounded queue, and waits
+    # longer than PASSWORD_HASH_TIMEOUT seconds are answered with a 503.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS') or 12)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE') or 32)
+    PASSWORD_HASH_TIMEOUT = int(os.environ.get('PASSWORD_HASH_TIMEOUT') or 10)
+    # Per-request query count and database time are always logged; debug
+    # mode or QUERY_STATS_HEADERS=1 also sends them as X-Query-* headers.
+    QUERY_STATS_HEADERS = os.environ.get('QUERY_STATS_HEADERS') == '1'
+    # Directory shared by all gunicorn workers for the /metrics samples.
+    METRICS_DIR = os.environ.get('METRICS_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'padalkaivlabs-metrics')
+    # /metrics answers only clients in METRICS_ALLOWED_NETWORKS (comma
+    # separated, loopback by default) or sending 'Authorization: Bearer
+    # METRICS_TOKEN'.
+    METRICS_ALLOWED_NETWORKS = os.environ.get('METRICS_ALLOWED_NETWORKS') or '127.0.0.0/8,::1/128'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Profiles of single requests are written to PROFILE_DIR; profiling is
+    # off without it. PROFILE_SAMPLE profiles one in N requests of some
+    # endpoints, e.g. 'main.posts:100,main.post:500'.
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    PROFILE_SAMPLE = os.environ.get('PROFILE_SAMPLE')
+    # Rows per statement and transaction of the admin bulk actions; SQLite
+    # before 3.32 allows at most 999 bound parameters.
+    BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE') or 500)
+    # flask-restplus: keep 404 messages of the API short.
+    ERROR_404_HELP = False
+    # Text responses from this size on are sent gzip or brotli compressed.
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 500)
+    # Workers that only serve the site or the API can skip importing
+    # Flask-Admin (with CKEditor) or flask-restplus.
+    ADMIN_ENABLED = os.environ.get('ADMIN_ENABLED', '1') == '1'
+    API_ENABLED = os.environ.get('API_ENABLED', '1') == '1'
+    # Totals of the admin list pages: 'exact' counts the rows on every page
+    # load, 'cached' reuses a count for ADMIN_COUNT_TTL seconds (as does
+    # /admin/users/; 0 recounts on every page load) and 'approximate' reads
+    # the table size from the database, counting the rows of a search only
+    # up to ADMIN_COUNT_LIMIT.
+    ADMIN_COUNT = os.environ.get('ADMIN_COUNT') or 'approximate'
+    ADMIN_COUNT_TTL = int(os.environ.get('ADMIN_COUNT_TTL') or 60)
+    ADMIN_COUNT_LIMIT = int(os.environ.get('ADMIN_COUNT_LIMIT') or 10000)
+    # Rate limits and concurrency limits of login, registration and account
+    # updates; state shared by all gunicorn workers lives in RATELIMIT_DIR.
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+    RATELIMIT_DIR = os.environ.get('RATELIMIT_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'padalkaivlabs-ratelimit')
+    # Requests of one limited endpoint running at once, across all workers.
+    RATELIMIT_CONCURRENCY = int(os.environ.get('RATELIMIT_CONCURRENCY') or 2 * (os.cpu_count() or 1))
+    # Compiled templates are shared by all workers through TEMPLATE_CACHE_DIR
+    # (default instance/template-cache); 'manage.py compile_templates' fills
+    # it at deploy time. TEMPLATES_PRELOAD loads every template when a worker
+    # starts. TEMPLATES_AUTO_RELOAD left unset checks the template files for
+    # changes in debug mode only.
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+    TEMPLATES_PRELOAD = os.environ.get('TEMPLATES_PRELOAD') == '1'
+
+
+class ProductionConfig(Config):
+    """Config of the gunicorn workers (wsgi.py)."""
+    # Regardless of FLASK_ENV / FLASK_DEBUG in the environment or .flaskenv.
+    ENV = 'production'
+    DEBUG = False
+    TEMPLATES_AUTO_RELOAD = False
+    TEMPLATES_PRELOAD = os.environ.get('TEMPLATES_PRELOAD', '1') == '1'
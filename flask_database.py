@@ -1,5 +1,20 @@
+import collections
+import itertools
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from faker import Faker
 from flask_script import Manager, prompt_bool, Command
-from app import db
+from sqlalchemy import bindparam, func
+from tqdm import tqdm
+
+from app import db, avatars, fragment_cache
+from app.bulk import recount_posts
+from app.content import render_body
+from app.models import User, Post
+from app.passwords import hasher
+from app.search import rebuild_index
 
 manager = Manager(usage="Perform database operations")
 
@@ -22,6 +37,173 @@ def recreate():
         dropdb()
         createdb()
 
+# Synthetic data is anchored to a fixed date so a seed always produces the
+# same rows.
+SYNTHETIC_EPOCH = datetime(2021, 1, 1)
+
+
+def load_synthetic_data(users, posts, seed=42, batch=10000, password='password', progress=True):
+    """Bulk-insert ``users`` users and ``posts`` posts of realistic-looking data.
+
+    Rows go in with executemany in chunked transactions, bypassing the ORM.
+    A few authors write most posts (Zipf-like), posting picks up towards the
+    present and a tenth of the posts were edited later. Every user gets the
+    same password, hashed once. User.post_count is set at the end.
+    """
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    # Faker is far too slow to call per row for millions of rows; draw from
+    # pools instead and keep usernames unique with a numeric suffix.
+    names = [fake.user_name() for _ in range(min(users, 5000))]
+    domains = [fake.free_email_domain() for _ in range(50)]
+    abouts = [fake.sentence(nb_words=10)[:200] for _ in range(2000)]
+    titles = [fake.sentence(nb_words=6)[:100] for _ in range(5000)]
+    bodies = [fake.text(max_nb_chars=140) for _ in range(5000)]
+    rendered = {body: render_body(body) for body in bodies}
+    password_hash = hasher.hash(password)
+
+    engine = db.engine
+    first_user = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    db.session.remove()
+    user_table, post_table = User.__table__, Post.__table__
+    span = timedelta(days=3 * 365).total_seconds()
+    bar = tqdm(total=users + posts, unit='rows', disable=not progress)
+
+    def insert(table, rows):
+        with engine.begin() as connection:
+            connection.execute(table.insert(), rows)
+        bar.update(len(rows))
+
+    rows = []
+    for i in range(users):
+        username = f'{names[i % len(names)]}{i}'
+        rows.append({
+            'id': first_user + i,
+            'username': username,
+            'email': f'{username}@{rng.choice(domains)}',
+            'password_hash': password_hash,
+            'about_me': rng.choice(abouts) if rng.random() < 0.3 else None,
+            'last_seen': SYNTHETIC_EPOCH - timedelta(seconds=rng.expovariate(1 / 86400 / 30)),
+            'admin': rng.random() < 0.001,
+        })
+        if len(rows) == batch:
+            insert(user_table, rows)
+            rows = []
+    if rows:
+        insert(user_table, rows)
+
+    author_ids = list(range(first_user, first_user + users))
+    rng.shuffle(author_ids)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** 1.1 for rank in range(users)))
+    post_counts = collections.Counter()
+    remaining = posts
+    while remaining > 0 and users:
+        size = min(batch, remaining)
+        authors = rng.choices(author_ids, cum_weights=cum_weights, k=size)
+        post_counts.update(authors)
+        rows = []
+        for author in authors:
+            # sqrt skews posting towards the end of the three years.
+            timestamp = SYNTHETIC_EPOCH - timedelta(seconds=span * (1 - rng.random() ** 0.5))
+            edited = rng.random() < 0.1
+            title, body = rng.choice(titles), rng.choice(bodies)
+            rows.append({
+                'title': title,
+                'body': body,
+                'body_html': rendered[body][0],
+                'excerpt': rendered[body][1],
+                'timestamp': timestamp,
+                'update_time': timestamp + timedelta(hours=rng.expovariate(1 / 48)) if edited else timestamp,
+                'user_id': author,
+            })
+        insert(post_table, rows)
+        remaining -= size
+    bar.close()
+
+    counts = [{'user': user, 'count': count} for user, count in post_counts.items()]
+    set_count = user_table.update().where(user_table.c.id == bindparam('user')) \
+        .values(post_count=bindparam('count'))
+    for start in range(0, len(counts), batch):
+        with engine.begin() as connection:
+            connection.execute(set_count, counts[start:start + batch])
+    return users, posts if users else 0
+
+
+@manager.option('-u', '--users', dest='users', type=int, default=1000, help='Number of users')
+@manager.option('-p', '--posts', dest='posts', type=int, default=10000, help='Number of posts')
+@manager.option('-s', '--seed', dest='seed', type=int, default=42, help='Random seed')
+@manager.option('-b', '--batch', dest='batch', type=int, default=10000, help='Rows per transaction')
+@manager.option('--password', dest='password', default='password', help='Password of every user')
+def init_data(users=1000, posts=10000, seed=42, batch=10000, password='password'):
+    "Fill the database with synthetic users and posts"
+    users, posts = load_synthetic_data(users, posts, seed=seed, batch=batch, password=password)
+    print(f"initialization completed: {users} users, {posts} posts")
+
+@manager.command
+def rebuild_search_index():
+    "Rebuild the full-text index of posts"
+    backend = rebuild_index()
+    print(f"search index rebuilt ({backend})")
+
+@manager.option('-a', '--all', dest='everything', action='store_true',
+                help='Also re-render posts that already have HTML')
+@manager.option('-b', '--batch', dest='batch', type=int, default=1000, help='Posts per transaction')
+def render_posts(everything=False, batch=1000):
+    "Render the sanitized HTML and excerpt of posts"
+    post_table = Post.__table__
+    update = post_table.update().where(post_table.c.id == bindparam('post_id')).values(
+        body_html=bindparam('html'), excerpt=bindparam('text'), version=post_table.c.version + 1)
+    query = db.session.query(Post.id, Post.body, Post.body_format)
+    if not everything:
+        query = query.filter(Post.body_html.is_(None))
+    rendered, last = 0, 0
+    while True:
+        rows = query.filter(Post.id > last).order_by(Post.id).limit(batch).all()
+        if not rows:
+            break
+        values = []
+        for post_id, body, body_format in rows:
+            html, text = render_body(body, body_format)
+            values.append({'post_id': post_id, 'html': html, 'text': text})
+        db.session.execute(update, values)
+        db.session.commit()
+        fragment_cache.invalidate('posts', *(f'post:{row.id}' for row in rows))
+        rendered += len(rows)
+        last = rows[-1].id
+    print(f"{rendered} posts rendered")
+
+@manager.command
+def recount_user_posts():
+    "Recompute the post count of every user"
+    recount_posts()
+    db.session.commit()
+    print("post counts recomputed")
+
+@manager.option('-n', '--dry-run', dest='dry_run', action='store_true', help='Only list the files')
+@manager.option('-g', '--grace', dest='grace', type=int, default=3600,
+                help='Keep files younger than this many seconds')
+def gc_avatars(dry_run=False, grace=3600):
+    "Remove profile pictures no user refers to"
+    referenced = [image_file for image_file, in db.session.query(User.image_file).distinct()]
+    removed = avatars.collect_garbage(referenced, grace=grace, dry_run=dry_run)
+    for filename in removed:
+        print(filename)
+    print(f"{len(removed)} files {'would be ' if dry_run else ''}removed")
+
 @manager.command
-def init_data():
-    print("initialization completed")
\ No newline at end of file
+def clone_replica():
+    "Copy the SQLite database to the file of the 'replica' bind"
+    replica = db.get_engine(bind='replica')
+    if db.engine.url.drivername != 'sqlite' or replica.url.drivername != 'sqlite':
+        print("clone_replica only copies SQLite databases; set up replication on the server")
+        return
+    source = db.engine.raw_connection()
+    target = sqlite3.connect(replica.url.database)
+    try:
+        # The backup API gives a consistent copy while the app keeps writing.
+        source.connection.backup(target)
+    finally:
+        target.close()
+        source.close()
+    print(f"copied {db.engine.url.database} to {replica.url.database}")
@@ -0,0 +1,13 @@
+import glob
+import os
+import tempfile
+
+# Must match METRICS_DIR in config.py.
+metrics_dir = os.environ.get('METRICS_DIR') or \
+    os.path.join(tempfile.gettempdir(), 'padalkaivlabs-metrics')
+
+
+def on_starting(server):
+    # Samples left by a previous server would be added to the new totals.
+    for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+        os.remove(path)
@@ -2,7 +2,9 @@ from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager
 from flask_script import Command, prompt_bool
 
-from app import app, db, models
+from app import create_app, db
+
+app = create_app()
 
 migrate = Migrate(app, db, render_as_batch=True)
 manager = Manager(app)
@@ -11,5 +13,26 @@ manager.add_command('db', MigrateCommand)
 from flask_database import manager as database_manager
 manager.add_command('database', database_manager)
 
+
+@manager.command
+def build_static():
+    "Fingerprint and precompress app/static into app/static/dist"
+    from app.static_files import build
+    manifest = build(app.static_folder)
+    print(f'{len(manifest)} files written to {app.static_folder}/dist')
+
+
+@manager.command
+def compile_templates():
+    "Compile every template into the shared template cache"
+    from app import templates
+    compiled, failed = templates.compile(app)
+    for name, error in failed:
+        print(f'{name}: {error}')
+    print(f'{len(compiled)} templates compiled to {templates.cache.directory}')
+    if failed:
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     manager.run()
\ No newline at end of file
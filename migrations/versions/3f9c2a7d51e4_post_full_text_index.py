@@ -0,0 +1,65 @@
+"""post full-text index
+
+Revision ID: 3f9c2a7d51e4
+Revises: ab4f01ad7801
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d51e4'
+down_revision = 'ab4f01ad7801'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_UPGRADE = (
+    "CREATE VIRTUAL TABLE post_fts USING fts5("
+    "title, body, content='post', content_rowid='id')",
+    "CREATE TRIGGER post_fts_ai AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body); "
+    "END",
+    "CREATE TRIGGER post_fts_ad AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "END",
+    "CREATE TRIGGER post_fts_au AFTER UPDATE OF title, body ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body); "
+    "END",
+    "INSERT INTO post_fts(post_fts) VALUES ('rebuild')",
+)
+
+SQLITE_DOWNGRADE = (
+    "DROP TRIGGER post_fts_au",
+    "DROP TRIGGER post_fts_ad",
+    "DROP TRIGGER post_fts_ai",
+    "DROP TABLE post_fts",
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX ix_post_fts ON post USING gin "
+            "(to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(body, '')))")
+    elif dialect == 'mysql':
+        op.execute('CREATE FULLTEXT INDEX ix_post_fts ON post (title, body)')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute('DROP INDEX ix_post_fts')
+    elif dialect == 'mysql':
+        op.execute('DROP INDEX ix_post_fts ON post')
@@ -0,0 +1,32 @@
+"""widen user.image_file for content-hashed names
+
+Revision ID: 6b1e0c93a2f7
+Revises: 3f9c2a7d51e4
+Create Date: 2026-10-18 11:02:17.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1e0c93a2f7'
+down_revision = '3f9c2a7d51e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('image_file',
+               existing_type=sa.String(length=20),
+               type_=sa.String(length=64),
+               existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('image_file',
+               existing_type=sa.String(length=64),
+               type_=sa.String(length=20),
+               existing_nullable=False)
@@ -0,0 +1,36 @@
+"""post body_format, body_html and excerpt
+
+Revision ID: a7d3e58c0f21
+Revises: f1a4c7e9b2d6
+Create Date: 2026-10-18 18:34:09.662871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e58c0f21'
+down_revision = 'f1a4c7e9b2d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing posts keep NULL body_html and excerpt, which the pages show as
+    # the escaped raw body, as before. Render them with
+    # 'manage.py database render_posts' after upgrading; the migration does
+    # not import the app's sanitizer, whose rules may change later.
+    op.add_column('post', sa.Column('body_format', sa.String(length=4), nullable=False,
+                                    server_default='text'))
+    op.add_column('post', sa.Column('body_html', sa.Text(), nullable=True))
+    op.add_column('post', sa.Column('excerpt', sa.String(length=200), nullable=True))
+
+
+def downgrade():
+    # Recreates post on SQLite, which drops the full-text triggers; run
+    # 'manage.py database rebuild_search_index' afterwards.
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('body_html')
+        batch_op.drop_column('body_format')
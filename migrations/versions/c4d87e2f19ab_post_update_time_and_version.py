@@ -0,0 +1,32 @@
+"""post update_time and version
+
+Revision ID: c4d87e2f19ab
+Revises: 6b1e0c93a2f7
+Create Date: 2026-10-18 11:47:53.220183
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d87e2f19ab'
+down_revision = '6b1e0c93a2f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('update_time', sa.DateTime(), nullable=True))
+    op.add_column('post', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    op.execute('UPDATE post SET update_time = timestamp')
+    op.create_index(op.f('ix_post_update_time'), 'post', ['update_time'], unique=False)
+
+
+def downgrade():
+    # Recreates post on SQLite, which drops the full-text triggers; run
+    # 'manage.py database rebuild_search_index' afterwards.
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_update_time'))
+        batch_op.drop_column('version')
+        batch_op.drop_column('update_time')
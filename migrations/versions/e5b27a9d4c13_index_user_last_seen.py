@@ -0,0 +1,23 @@
+"""index user.last_seen for sorting the admin user list
+
+Revision ID: e5b27a9d4c13
+Revises: c4d87e2f19ab
+Create Date: 2026-10-18 14:21:36.118204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b27a9d4c13'
+down_revision = 'c4d87e2f19ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_user_last_seen'), 'user', ['last_seen'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_last_seen'), table_name='user')
@@ -0,0 +1,31 @@
+"""post (user_id, timestamp) index and user.post_count
+
+Revision ID: f1a4c7e9b2d6
+Revises: e5b27a9d4c13
+Create Date: 2026-10-18 16:02:41.507319
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a4c7e9b2d6'
+down_revision = 'e5b27a9d4c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_post_user_id_timestamp', 'post', ['user_id', 'timestamp'], unique=False)
+    op.add_column('user', sa.Column('post_count', sa.Integer(), nullable=False, server_default='0'))
+    user = sa.table('user', sa.column('id'), sa.column('post_count'))
+    post = sa.table('post', sa.column('user_id'))
+    op.execute(user.update().values(
+        post_count=sa.select([sa.func.count()]).where(post.c.user_id == user.c.id).as_scalar()))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('post_count')
+    op.drop_index('ix_post_user_id_timestamp', table_name='post')
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app, db, last_seen
+from app.models import User, Post
+from config import Config
+
+PASSWORD = 'secret-password'
+
+
+def make_config(tmpdir):
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmpdir.join('test.db'))
+        SQLALCHEMY_BINDS = None
+        BCRYPT_LOG_ROUNDS = 4
+        # Cached fragments and counts would hide the queries being budgeted.
+        FRAGMENT_CACHE_BACKEND = 'null'
+        POSTS_COUNT_TTL = 0
+        ADMIN_COUNT_TTL = 0
+        USER_CACHE_TTL = 0
+        RATELIMIT_ENABLED = False
+        RATELIMIT_DIR = str(tmpdir.join('ratelimit'))
+        METRICS_DIR = str(tmpdir.join('metrics'))
+        TEMPLATE_CACHE_DIR = str(tmpdir.join('templates'))
+
+    return TestConfig
+
+
+@pytest.fixture
+def app(tmpdir):
+    app = create_app(make_config(tmpdir))
+    with app.app_context():
+        db.create_all()
+        yield app
+        last_seen.flush()
+        db.session.remove()
+        db.drop_all()
+
+
+def make_user(username, admin=False, posts=0, raw_posts=0):
+    """A user with ``posts`` written through the ORM and ``raw_posts``
+    inserted with plain SQL, which have no body_html or excerpt."""
+    user = User(username=username, email=f'{username}@example.com', admin=admin)
+    user.set_password(PASSWORD)
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2020, 1, 1)
+    for i in range(posts):
+        post = Post(title=f'{username} post {i}', author=user, timestamp=start + timedelta(hours=i))
+        post.set_body(f'Body of post {i} by {username}.')
+        db.session.add(post)
+    db.session.commit()
+    for i in range(raw_posts):
+        db.session.execute(Post.__table__.insert().values(
+            title=f'{username} raw post {i}', body=f'<b>raw body {i}</b>', user_id=user.id,
+            timestamp=start + timedelta(days=1, hours=i), update_time=start))
+    db.session.commit()
+    return user
+
+
+def login(client, user):
+    response = client.post('/login', data={'email': user.email, 'password': PASSWORD})
+    assert response.status_code == 302
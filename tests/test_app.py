@@ -0,0 +1,12 @@
+import pytest
+
+from app import create_app
+
+from .conftest import make_config
+
+
+def test_replaced_app_refuses_requests(app, tmpdir):
+    newer = create_app(make_config(tmpdir))
+    with pytest.raises(RuntimeError):
+        app.test_client().get('/login')
+    assert newer.test_client().get('/login').status_code == 200
@@ -0,0 +1,27 @@
+import pytest
+
+from app import metrics
+
+REMOTE = {'REMOTE_ADDR': '203.0.113.7'}
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setattr(metrics, 'token', 'scrape-token')
+    return app.test_client()
+
+
+def test_metrics_loopback(client):
+    assert client.get('/metrics').status_code == 200
+
+
+@pytest.mark.parametrize('authorization, status', [
+    (None, 404),
+    ('Bearer wrong', 404),
+    ('Bearer sécret', 404),
+    ('Bearer scrape-token', 200),
+])
+def test_metrics_token(client, authorization, status):
+    headers = {'Authorization': authorization} if authorization else {}
+    response = client.get('/metrics', headers=headers, environ_base=REMOTE)
+    assert response.status_code == status
@@ -0,0 +1,51 @@
+"""Every view with a query_budget, rendered with enough rows to expose an N+1.
+
+Under TESTING a view going over its budget raises QueryBudgetExceeded.
+"""
+from app.models import Post
+
+from .conftest import login, make_user
+
+
+def test_posts(app):
+    user = make_user('alice', posts=4, raw_posts=4)
+    make_user('bob', posts=4)
+    client = app.test_client()
+    login(client, user)
+    response = client.get('/posts')
+    assert response.status_code == 200
+    assert b'&lt;b&gt;raw body' in response.data
+    assert client.get('/posts?page=2').status_code == 200
+
+
+def test_posts_search(app):
+    user = make_user('alice', posts=4, raw_posts=4)
+    client = app.test_client()
+    login(client, user)
+    assert client.get('/posts?q=body').status_code == 200
+
+
+def test_post(app):
+    make_user('alice', posts=1, raw_posts=1)
+    client = app.test_client()
+    for post in Post.query.all():
+        assert client.get(f'/post/{post.id}').status_code == 200
+
+
+def test_user_posts(app):
+    user = make_user('alice', posts=2, raw_posts=4)
+    client = app.test_client()
+    login(client, user)
+    response = client.get('/user/alice')
+    assert response.status_code == 200
+    assert b'&lt;b&gt;raw body' in response.data
+
+
+def test_users_list_admin(app):
+    admin = make_user('admin', admin=True)
+    for i in range(5):
+        make_user(f'user{i}', posts=1)
+    client = app.test_client()
+    login(client, admin)
+    assert client.get('/admin/users/').status_code == 200
+    assert client.get('/admin/users/?q=user').status_code == 200
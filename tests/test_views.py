@@ -0,0 +1,64 @@
+import hashlib
+import io
+
+import pytest
+
+from app import avatars, db
+from app.models import Post, User
+
+from .conftest import login, make_user
+
+
+@pytest.mark.parametrize('page', ['0', '-3'])
+def test_posts_page_below_one(app, page):
+    user = make_user('alice', posts=4)
+    client = app.test_client()
+    login(client, user)
+    assert client.get(f'/posts?page={page}').status_code == 404
+    assert client.get(f'/posts?q=post&page={page}').status_code == 404
+
+
+@pytest.mark.parametrize('page', ['0', '-3'])
+def test_users_list_admin_page_below_one(app, page):
+    admin = make_user('admin', admin=True)
+    client = app.test_client()
+    login(client, admin)
+    assert client.get('/admin/users/').status_code == 200
+    assert client.get(f'/admin/users/?page={page}').status_code == 404
+
+
+def test_account_known_picture_is_applied_at_once(app, tmpdir, monkeypatch):
+    monkeypatch.setattr(avatars, 'directory', str(tmpdir))
+    data = b'picture uploaded before'
+    name = hashlib.sha256(avatars.signature + data).hexdigest()[:32]
+    for size in avatars.sizes:
+        for ext in ('jpg', 'webp'):
+            tmpdir.join(avatars.filename(name, size, ext)).write('')
+    user = make_user('alice')
+    client = app.test_client()
+    login(client, user)
+    response = client.post('/account', follow_redirects=True, data={
+        'username': 'alice', 'email': 'alice@example.com',
+        'picture': (io.BytesIO(data), 'me.png')})
+    assert b'Your account has been updated!' in response.data
+    assert b'will appear in a moment' not in response.data
+    db.session.expire_all()
+    assert User.query.get(user.id).image_file == f'{name}.jpg'
+
+
+def test_edit_post_keeps_html_format(app):
+    user = make_user('alice')
+    post = Post(title='Formatted', author=user)
+    post.set_body('<p>Some <strong>bold</strong> words</p>', 'html')
+    db.session.add(post)
+    db.session.commit()
+    client = app.test_client()
+    login(client, user)
+    response = client.post(f'/edit_post/{post.id}', data={
+        'post_title': 'Formatted', 'post_body': '<p>Now <em>edited</em></p>'})
+    assert response.status_code == 200
+    db.session.expire_all()
+    post = Post.query.get(post.id)
+    assert post.body_format == 'html'
+    assert post.body_html == '<p>Now <em>edited</em></p>'
+    assert b'<p>Now <em>edited</em></p>' in client.get(f'/post/{post.id}').data
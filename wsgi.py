@@ -0,0 +1,5 @@
+"""WSGI entry point: ``gunicorn wsgi:app`` (see Procfile and gunicorn.conf.py)."""
+from app import create_app
+from config import ProductionConfig
+
+app = create_app(ProductionConfig)